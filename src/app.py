@@ -1,14 +1,57 @@
-from flask import Flask, request, render_template, send_from_directory, jsonify
-from investment_strategy.api import get_all_strategies, get_data, get_info, run_strategy
-from investment_strategy.utils import to_dict, NpEncoder
-from investment_strategy.date_utils import add_timezone_to_datetime
+from flask import Flask, Response, stream_with_context, request, render_template, send_from_directory, jsonify, g
+from investment_strategy import api
+from investment_strategy.api import get_all_strategies, get_data, get_info, run_strategies, run_strategies_job, run_batch, sweep_strategy, simulate_strategy, walk_forward_strategy, run_portfolio, parse_strategy_data
+from investment_strategy.jobs import JobQueueFull
+from investment_strategy.downsample import downsample_df
+from investment_strategy.metrics import metrics, iter_timed, SamplingProfiler
+from investment_strategy.utils import to_dict, iter_json_strategy_results, select_columns, to_typed_arrays, encode_typed_arrays, NpEncoder, TYPED_ARRAYS_MIMETYPE
 import json
-import copy
-from datetime import datetime
+import os
+import time
+import uuid
 
 
 app = Flask(__name__, static_folder="frontend/build/static", template_folder="frontend/build")
 
+# Strategies in a request are run in parallel on a thread or process pool
+app.config["STRATEGY_EXECUTOR"] = os.environ.get("STRATEGY_EXECUTOR", "thread")
+app.config["STRATEGY_MAX_WORKERS"] = int(os.environ["STRATEGY_MAX_WORKERS"]) if "STRATEGY_MAX_WORKERS" in os.environ else None
+app.config["STRATEGY_TIMEOUT"] = float(os.environ["STRATEGY_TIMEOUT"]) if "STRATEGY_TIMEOUT" in os.environ else None
+
+# Add the time of each stage of a request as a Server-Timing header, and sample a profile of each request into a directory
+app.config["SERVER_TIMING"] = os.environ.get("SERVER_TIMING", "0") == "1"
+app.config["PROFILE_DIRECTORY"] = os.environ.get("PROFILE_DIRECTORY") or None
+app.config["PROFILE_INTERVAL"] = float(os.environ.get("PROFILE_INTERVAL", 0.005))
+
+
+@app.before_request
+def start_request_metrics():
+    if metrics.enabled:
+        g.metrics_recording = metrics.start_recording()
+        g.request_start = time.perf_counter()
+    if app.config["PROFILE_DIRECTORY"] is not None:
+        g.profiler = SamplingProfiler(app.config["PROFILE_INTERVAL"]).start()
+
+
+@app.after_request
+def add_server_timing(response):
+    # Streamed responses are encoded after this, so their encoding is only in the metrics
+    if app.config["SERVER_TIMING"] and "metrics_recording" in g:
+        recorder, _ = g.metrics_recording
+        timings = recorder.server_timing()
+        total = f"total;dur={(time.perf_counter() - g.request_start) * 1e3:.2f}"
+        response.headers["Server-Timing"] = f"{timings}, {total}" if timings else total
+    return response
+
+
+@app.teardown_request
+def stop_request_metrics(exception=None):
+    if "metrics_recording" in g:
+        metrics.stop_recording(g.pop("metrics_recording"))
+    if "profiler" in g:
+        filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint}-{uuid.uuid4().hex[:8]}.folded"
+        g.pop("profiler").stop(os.path.join(app.config["PROFILE_DIRECTORY"], filename))
+
 
 @app.route("/")
 def home():
@@ -35,11 +78,40 @@ def logo128():
     return send_from_directory(app.template_folder, 'logo128.png')
 
 
+def wants_typed_arrays():
+    """Whether the client asked for typed arrays rather than json, with an Accept header or format=typed_arrays"""
+    return request.args.get('format') == "typed_arrays" or request.accept_mimetypes.best_match(["application/json", TYPED_ARRAYS_MIMETYPE]) == TYPED_ARRAYS_MIMETYPE
+
+
+def requested_columns():
+    """The subset of columns the client asked for, from a comma separated columns parameter or a posted columns list"""
+    if request.args.get('columns'):
+        return request.args.get('columns').split(",")
+    elif request.is_json and request.json.get("columns"):
+        return request.json["columns"]
+
+
+def requested_max_points():
+    """The maximum number of points the client asked for, from a max_points parameter or a posted max_points"""
+    if request.args.get('max_points'):
+        return int(request.args.get('max_points'))
+    elif request.is_json and request.json.get("max_points"):
+        return int(request.json["max_points"])
+
+
 @app.route("/api/get_data/")
 def get_data_():
     ticker = request.args.get('ticker')
-    data = get_data(ticker)
-    return jsonify({"info": get_info(ticker), "data": to_dict(data)})
+    df = get_data(ticker)
+    with metrics.timer("downsample", ticker=ticker):
+        data = downsample_df(df, requested_max_points())
+    info = get_info(ticker)
+
+    with metrics.timer("encode", ticker=ticker):
+        if wants_typed_arrays():
+            arrays = [(None, name, array) for name, array in to_typed_arrays(data, requested_columns())]
+            return Response(encode_typed_arrays({"info": info}, arrays), mimetype=TYPED_ARRAYS_MIMETYPE)
+        return jsonify({"info": info, "data": to_dict(select_columns(data, requested_columns()))})
 
 
 @app.route("/api/get_all_strategies/")
@@ -47,24 +119,155 @@ def get_strategies():
     return jsonify({"strategies": get_all_strategies()})
 
 
+@app.route("/api/cache_stats/")
+def cache_stats():
+    return jsonify({"price_cache": api.price_cache.stats() if api.price_cache is not None else None, "data_cache": api.data_cache.stats(),
+        "indicator_store": api.indicator_store.stats(), "jobs": api.job_queue.stats()})
+
+
+@app.route("/api/metrics/")
+def metrics_():
+    stages = metrics.snapshot()
+    if request.args.get('reset') == "true":
+        metrics.reset()
+    return jsonify({"enabled": metrics.enabled, "stages": stages})
+
+
 @app.route("/api/post_strategy/", methods=["POST"])
 def run_strategy_():
+    ticker = request.json["ticker"]
+    df_base = get_data(ticker)
+    strategy_run_data = run_strategies(df_base, request.json["strategy"], max_workers=app.config["STRATEGY_MAX_WORKERS"],
+        executor=app.config["STRATEGY_EXECUTOR"], timeout=app.config["STRATEGY_TIMEOUT"])
+    return strategy_results_response(ticker, strategy_run_data)
+
+
+def strategy_results_response(ticker, strategy_run_data):
+    """Respond with the results of strategies (for a ticker, if known), as json or typed arrays, without changing strategy_run_data"""
+    strategy_run_data = {name: dict(run_data) for name, run_data in strategy_run_data.items()}
+
+    # Summaries are calculated on all the data, only the data sent back for charting is downsampled
+    for strategy_i_name, strategy_i_run_data in strategy_run_data.items():
+        if "data" in strategy_i_run_data:
+            with metrics.timer("downsample", strategy=strategy_i_name, ticker=ticker):
+                strategy_i_run_data["data"] = downsample_df(strategy_i_run_data["data"], requested_max_points())
+
+    if wants_typed_arrays():
+        with metrics.timer("encode", ticker=ticker):
+            header = {"strategies": {}}
+            arrays = []
+            for strategy_i_name, strategy_i_run_data in strategy_run_data.items():
+                if "data" in strategy_i_run_data:
+                    header["strategies"][strategy_i_name] = {"summary": strategy_i_run_data["summary"]}
+                    arrays.extend((strategy_i_name, name, array) for name, array in to_typed_arrays(strategy_i_run_data["data"], requested_columns()))
+                else:
+                    header["strategies"][strategy_i_name] = strategy_i_run_data
+            return Response(encode_typed_arrays(header, arrays), mimetype=TYPED_ARRAYS_MIMETYPE)
+
+    for strategy_i_run_data in strategy_run_data.values():
+        if "data" in strategy_i_run_data:
+            strategy_i_run_data["data"] = select_columns(strategy_i_run_data["data"], requested_columns())
+
+    # Stream the json rather than building it all in memory. Note: strategy will fail if any value is NaN.
+    return Response(stream_with_context(iter_timed(iter_json_strategy_results(strategy_run_data), "encode", ticker=ticker)), mimetype="application/json")
+
+
+@app.route("/api/post_strategy_job/", methods=["POST"])
+def run_strategy_job_():
+    # Identical requests share a job while it is queued or running, the columns and points sent back don't matter
+    key = json.dumps({"ticker": request.json["ticker"], "strategy": request.json["strategy"]}, sort_keys=True)
+    try:
+        job = api.job_queue.submit(run_strategies_job, request.json["ticker"], request.json["strategy"], app.config["STRATEGY_EXECUTOR"], key=key)
+    except JobQueueFull as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify(job.summary()), 202
+
+
+@app.route("/api/get_job/")
+def get_job_():
+    job = api.job_queue.get(request.args.get('job_id'))
+    if job is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+    return jsonify(job.summary())
+
+
+@app.route("/api/get_job_result/")
+def get_job_result_():
+    job = api.job_queue.get(request.args.get('job_id'))
+    if job is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+    elif job.status != "done":
+        return jsonify(job.summary()), 202 if job.in_flight() else 409
+    return strategy_results_response(None, job.result)
+
+
+@app.route("/api/post_cancel_job/", methods=["POST"])
+def cancel_job_():
+    job = api.job_queue.cancel(request.json["job_id"])
+    if job is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+    return jsonify(job.summary())
+
+
+@app.route("/api/post_strategy_sweep/", methods=["POST"])
+def sweep_strategy_():
     df_base = get_data(request.json["ticker"])
-    strategy_run_data = {}
+    strategy, initial_investment, regular_investment, regular_investment_frequency, start_date = parse_strategy_data(request.json["strategy"])
+
+    try:
+        results = sweep_strategy(df_base, strategy, initial_investment, regular_investment, regular_investment_frequency, request.json["parameter_ranges"],
+            start_date, strategy_parameters=request.json["strategy"], max_workers=app.config["STRATEGY_MAX_WORKERS"], executor=app.config["STRATEGY_EXECUTOR"])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Stream the ranked results back as one json object per line
+    top = request.json.get("top")
+    def generate():
+        for result in results[:top]:
+            yield json.dumps(result, cls=NpEncoder) + "\n"
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
+
+@app.route("/api/post_strategy_simulation/", methods=["POST"])
+def simulate_strategy_():
+    df_base = get_data(request.json["ticker"])
+    simulation_parameters = {name: request.json[name] for name in ("n_paths", "years", "method", "block_size", "seed") if name in request.json}
+
+    try:
+        results = simulate_strategy(df_base, request.json["strategy"], **simulation_parameters, max_workers=app.config["STRATEGY_MAX_WORKERS"],
+            executor=app.config["STRATEGY_EXECUTOR"])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(results)
+
+
+@app.route("/api/post_strategy_walk_forward/", methods=["POST"])
+def walk_forward_strategy_():
+    df_base = get_data(request.json["ticker"])
+    walk_forward_parameters = {name: request.json[name] for name in ("horizon_years", "frequency") if name in request.json}
+    table = walk_forward_strategy(df_base, request.json["strategy"], **walk_forward_parameters, max_workers=app.config["STRATEGY_MAX_WORKERS"],
+        executor=app.config["STRATEGY_EXECUTOR"])
+    return json.dumps(table, cls=NpEncoder)
+
 
-    for strategy_i_name, strategy_i_data in request.json["strategy"].items():
-        df = copy.deepcopy(df_base)
-        initial_investment = float(strategy_i_data["initial_investment"])
-        regular_investment = float(strategy_i_data["regular_investment"])
-        regular_investment_frequency = strategy_i_data["regular_investment_frequency"]
-        strategy = strategy_i_data["strategy"]
-        start_date = add_timezone_to_datetime(datetime.fromisoformat(strategy_i_data["start_date"]))
+@app.route("/api/post_portfolio/", methods=["POST"])
+def run_portfolio_():
+    try:
+        summary, df_results = run_portfolio(request.json["tickers"], request.json["strategy"], weights=request.json.get("weights"),
+            rebalance_frequency=request.json.get("rebalance_frequency"), max_workers=app.config["STRATEGY_MAX_WORKERS"])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    data = select_columns(downsample_df(df_results, requested_max_points()), requested_columns())
+    return json.dumps({"summary": summary, "data": to_dict(data)}, cls=NpEncoder)
 
-        summary, df_results = run_strategy(df, strategy, initial_investment, regular_investment, regular_investment_frequency, start_date, strategy_parameters=strategy_i_data)
-        strategy_run_data[strategy_i_name] = {"summary": summary, "data": to_dict(df_results)}
 
-    # Note: strategy will fail if any value is NaN.
-    return json.dumps(strategy_run_data, cls=NpEncoder)
+@app.route("/api/post_batch/", methods=["POST"])
+def run_batch_():
+    summaries = run_batch(request.json["tickers"], request.json["strategy"], max_workers=app.config["STRATEGY_MAX_WORKERS"],
+        executor=app.config["STRATEGY_EXECUTOR"])
+    summaries = summaries.astype(object).where(summaries.notna(), None)   # Missing values (e.g., errors) as null
+    return json.dumps(summaries.to_dict(orient="records"), cls=NpEncoder)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,186 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime, timezone
+
+# Benchmarks never use the real caches, the price cache is replaced with one of synthetic histories below
+os.environ["INVESTMENT_STRATEGY_CACHE_DIR"] = ""
+os.environ["INVESTMENT_STRATEGY_INDICATOR_DIR"] = ""
+
+import numpy as np
+import pandas as pd
+from app import app
+from investment_strategy import api
+from investment_strategy.cache import PriceHistoryCache
+from investment_strategy.date_utils import get_nearest_date_in_df
+from investment_strategy.filter import remove_zero_open_data
+from investment_strategy.strategies import Investments, Strategy
+from investment_strategy.strategies_utils import get_velocity_data, get_velocity_data_with_drag
+from investment_strategy.utils import to_dict
+from benchmarks.synthetic import synthetic_ohlc, synthetic_downloader
+
+
+SIZES = (1000, 10000, 100000, 1000000)
+
+
+def get_benchmarks(n_rows, frequency="months", seed=0):
+    """Get a dict of benchmark names to functions to time on a synthetic price history of n_rows bars"""
+    df = remove_zero_open_data(synthetic_ohlc(n_rows, seed=seed))[["Open"]]
+    benchmarks = {}
+
+    for strategy_class in Strategy.__subclasses__():
+        parameters = {parameter["name"]: parameter["default"] for parameter in strategy_class._get_additional_parameters()}
+        benchmarks[f"strategy.{strategy_class.__name__}"] = \
+            lambda strategy_class=strategy_class, parameters=parameters: strategy_class(df, Investments(1000, 100, frequency), strategy_parameters=parameters).evaluate()
+
+    benchmarks["strategies_utils.get_velocity_data"] = lambda: get_velocity_data(df)
+    benchmarks["strategies_utils.get_velocity_data_with_drag"] = lambda: get_velocity_data_with_drag(df)
+
+    # Single lookups are too quick to time reliably, so time a batch of them
+    dates = pd.to_datetime(np.random.default_rng(seed).integers(df.index[0].value, df.index[-1].value, 1000), utc=True).tz_convert(df.index.tz)
+    benchmarks["date_utils.get_nearest_date_in_df[x1000]"] = lambda: [get_nearest_date_in_df(df, date) for date in dates]
+    benchmarks["utils.to_dict"] = lambda: to_dict(df)
+
+    benchmarks["app.post_strategy"] = _post_strategy_benchmark(n_rows, frequency, seed)
+    return benchmarks
+
+
+def _post_strategy_benchmark(n_rows, frequency="months", seed=0):
+    """Get a function posting every strategy to /api/post_strategy/ for a ticker with a synthetic history"""
+    ticker = f"SYNTHETIC-{n_rows}-{seed}"
+    start_date = synthetic_ohlc(1, seed=seed).index[0].strftime("%Y-%m-%d")
+    strategies = {}
+    for strategy_class in Strategy.__subclasses__():
+        strategies[strategy_class.__name__] = {"strategy": strategy_class.__name__, "initial_investment": 1000, "regular_investment": 100,
+            "regular_investment_frequency": frequency, "start_date": start_date,
+            **{parameter["name"]: parameter["default"] for parameter in strategy_class._get_additional_parameters()}}
+    client = app.test_client()
+
+    def post_strategy():
+        # Each request starts with cold in-memory caches, only the price history is read from the (synthetic) cache
+        api.data_cache.clear()
+        api.indicator_store.clear()
+        response = client.post("/api/post_strategy/", json={"ticker": ticker, "strategy": strategies})
+        response.get_data()
+        if response.status_code != 200:
+            raise RuntimeError(f"Request failed with status {response.status_code}")
+    return post_strategy
+
+
+def time_benchmark(func, repeat=3):
+    """Time a function repeat times, returning the minimum and median times in seconds or the error it raised"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            func()
+        except Exception as e:
+            return {"error": f"{type(e).__name__}: {e}"}
+        times.append(time.perf_counter() - start)
+    return {"min": min(times), "median": statistics.median(times), "repeat": repeat}
+
+
+def run_benchmarks(sizes=SIZES, repeat=3, frequency="months", seed=0, name_filter=None, log=print):
+    """Run the benchmarks for each size, returning the results keyed by benchmark name and size"""
+    results = {}
+    with tempfile.TemporaryDirectory() as directory, warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for n_rows in sizes:
+            api.price_cache = PriceHistoryCache(os.path.join(directory, str(n_rows)), downloader=synthetic_downloader(n_rows))
+            for name, func in get_benchmarks(n_rows, frequency, seed).items():
+                if name_filter is not None and name_filter not in name:
+                    continue
+                key = f"{name}[{n_rows}]"
+                results[key] = time_benchmark(func, repeat)
+                if log is not None:
+                    log(_format_result(key, results[key]))
+    return {"meta": get_meta(repeat, frequency, seed), "results": results}
+
+
+def get_meta(repeat=3, frequency="months", seed=0):
+    """Get details of the environment and settings the benchmarks were run with"""
+    return {"created_at": datetime.now(timezone.utc).isoformat(), "python": platform.python_version(), "platform": platform.platform(),
+        "numpy": np.__version__, "pandas": pd.__version__, "repeat": repeat, "frequency": frequency, "seed": seed}
+
+
+def compare_results(results, baseline, tolerance=0.25, min_difference=1e-3):
+    """Compare benchmark results with a baseline, flagging regressions and improvements.
+
+    A benchmark is a regression if its minimum time is more than tolerance (as a fraction) slower than the baseline and
+    the difference is more than min_difference seconds, so noise in very quick benchmarks isn't flagged.
+    """
+    comparison = []
+    for key, result in results["results"].items():
+        baseline_result = baseline["results"].get(key)
+        if baseline_result is None or "min" not in baseline_result or "min" not in result:
+            status = "error" if "error" in result else "new"
+            comparison.append({"benchmark": key, "baseline": None, "current": result.get("min"), "ratio": None, "status": status})
+            continue
+
+        ratio = result["min"] / baseline_result["min"] if baseline_result["min"] > 0 else np.inf
+        difference = result["min"] - baseline_result["min"]
+        if ratio > 1 + tolerance and difference > min_difference:
+            status = "regression"
+        elif ratio < 1 / (1 + tolerance) and -difference > min_difference:
+            status = "improvement"
+        else:
+            status = "ok"
+        comparison.append({"benchmark": key, "baseline": baseline_result["min"], "current": result["min"], "ratio": ratio, "status": status})
+    return comparison
+
+
+def _format_result(key, result):
+    if "error" in result:
+        return f"{key:<60} {result['error']}"
+    return f"{key:<60} min {result['min'] * 1e3:10.2f} ms  median {result['median'] * 1e3:10.2f} ms"
+
+
+def _format_comparison(row):
+    if row["ratio"] is None:
+        return f"{row['benchmark']:<60} {row['status']}"
+    return f"{row['benchmark']:<60} {row['baseline'] * 1e3:10.2f} ms -> {row['current'] * 1e3:10.2f} ms  x{row['ratio']:5.2f}  {row['status']}"
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark the strategies, indicators and api on synthetic price histories")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="Numbers of bars in the synthetic price histories")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of times each benchmark is run, the minimum time is compared")
+    parser.add_argument("--frequency", default="months", help="Regular investment frequency of the strategies")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic price histories")
+    parser.add_argument("--filter", default=None, help="Only run benchmarks with names containing this")
+    parser.add_argument("--output", default=None, help="Path to save the results to as json")
+    parser.add_argument("--results", default=None, help="Path of saved results to compare instead of running the benchmarks")
+    parser.add_argument("--baseline", default=None, help="Path of saved results to compare against, exits with 1 if there are regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Fraction slower than the baseline that is a regression")
+    args = parser.parse_args(args)
+
+    if args.results is not None:
+        with open(args.results) as f:
+            results = json.load(f)
+    else:
+        results = run_benchmarks(args.sizes, args.repeat, args.frequency, args.seed, args.filter)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        comparison = compare_results(results, baseline, tolerance=args.tolerance)
+        for row in comparison:
+            print(_format_comparison(row))
+        regressions = [row for row in comparison if row["status"] == "regression"]
+        print(f"{len(regressions)} regressions")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import zlib
+import numpy as np
+import pandas as pd
+
+
+def synthetic_ohlc(n_rows, seed=0, start="1900-01-01", freq=None, tz="America/New_York", initial_price=100.0, drift=0.05, volatility=0.2):
+    """Generate a deterministic OHLC price history with n_rows bars, in the same format as a yfinance history.
+
+    Prices follow a geometric brownian motion with the given annual drift and volatility. Bars are business days unless
+    there are too many to fit in the range of pandas timestamps, in which case they are hourly.
+    """
+    if freq is None:
+        freq = "B" if n_rows <= 50000 else "H"
+    index = pd.date_range(start, periods=n_rows, freq=freq, tz=tz)
+    bars_per_year = 252 if freq == "B" else 252 * 24
+
+    rng = np.random.default_rng(seed)
+    dt = 1 / bars_per_year
+    log_returns = (drift - volatility ** 2 / 2) * dt + volatility * np.sqrt(dt) * rng.standard_normal(n_rows)
+    close = initial_price * np.exp(np.cumsum(log_returns))
+    open_ = np.concatenate(([initial_price], close[:-1]))
+
+    # Highs and lows range a random fraction of the volatility beyond the open and close
+    spread = volatility * np.sqrt(dt) * np.abs(rng.standard_normal((2, n_rows)))
+    high = np.maximum(open_, close) * (1 + spread[0])
+    low = np.minimum(open_, close) * (1 - spread[1])
+    volume = rng.integers(1e5, 1e7, n_rows).astype(float)
+
+    return pd.DataFrame({"Open": open_, "High": high, "Low": low, "Close": close, "Volume": volume, "Dividends": 0.0, "Stock Splits": 0.0},
+        index=pd.DatetimeIndex(index, name="Date"))
+
+
+def synthetic_downloader(n_rows):
+    """Get a downloader for a PriceHistoryCache giving synthetic histories of n_rows bars, seeded by the ticker"""
+    def downloader(ticker, start=None):
+        df = synthetic_ohlc(n_rows, seed=zlib.crc32(ticker.encode()))
+        return df if start is None else df[df.index >= start]
+    return downloader
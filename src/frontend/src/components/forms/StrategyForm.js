@@ -68,7 +68,15 @@ function StrategyForm(props) {
       })
       .then(res => res.json())
       .then(
-          (data) => {props.setStrategyData(data); props.setRunningStrategy(false);},
+          (data) => {
+            // Strategies are run independently, so remove any which failed and show the rest.
+            const failedStrategies = Object.keys(data).filter(strategy => "error" in data[strategy]);
+            failedStrategies.forEach(strategy => {console.log(`Strategy ${strategy} failed: ${data[strategy].error}`); delete data[strategy];});
+            if (failedStrategies.length > 0) {
+              alert(`These strategies failed: ${failedStrategies.join(", ")}`);
+            }
+            props.setStrategyData(data); props.setRunningStrategy(false);
+          },
           (error) => {console.log('Strategy failed'); props.setRunningStrategy(false);}
       )
   }
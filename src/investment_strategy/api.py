@@ -1,8 +1,47 @@
+import os
+import itertools
+import math
+import multiprocessing
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
+from datetime import datetime
 from .filter import filter_df_by_date, remove_zero_open_data
+from .cache import PriceHistoryCache, LRUCache
+from .indicators import IndicatorStore
+from .jobs import JobQueue
+from . import simulation
+from . import walk_forward
+from .portfolio import Portfolio
+from .date_utils import add_timezone_to_datetime
+from .metrics import metrics, run_recorded, get_recorded_result
 import yfinance as yf
 from .strategies import *
 
 
+# Cache of full price histories, set INVESTMENT_STRATEGY_CACHE_DIR to an empty string to disable it
+cache_directory = os.environ.get("INVESTMENT_STRATEGY_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "investment_strategy"))
+if cache_directory:
+    price_cache = PriceHistoryCache(cache_directory, ttl=float(os.environ.get("INVESTMENT_STRATEGY_CACHE_TTL", 12 * 60 * 60)),
+        max_bytes=int(os.environ.get("INVESTMENT_STRATEGY_CACHE_MAX_BYTES", 512 * 1024 ** 2)))
+else:
+    price_cache = None
+
+# In-process cache of cleaned data and info shared across requests
+data_cache = LRUCache(max_entries=64, max_bytes=256 * 1024 ** 2, ttl=60 * 60)
+
+# Indicators shared across strategies and requests, persisted next to the price cache unless INVESTMENT_STRATEGY_INDICATOR_DIR is empty
+indicator_directory = os.environ.get("INVESTMENT_STRATEGY_INDICATOR_DIR", cache_directory + "_indicators" if cache_directory else "")
+indicator_store = IndicatorStore(indicator_directory or None, max_entries=int(os.environ.get("INVESTMENT_STRATEGY_INDICATOR_MAX_ENTRIES", 256)),
+    max_bytes=int(os.environ.get("INVESTMENT_STRATEGY_INDICATOR_MAX_BYTES", 256 * 1024 ** 2)))
+
+# Long running requests run as jobs in the background, on a few threads so they don't starve interactive requests. Their
+# strategies run on a pool of job_strategy_workers shared by all the jobs, separate from the pool for interactive requests.
+job_queue = JobQueue(max_workers=int(os.environ.get("INVESTMENT_STRATEGY_JOB_WORKERS", 2)), ttl=float(os.environ.get("INVESTMENT_STRATEGY_JOB_TTL", 60 * 60)),
+    max_result_bytes=int(os.environ.get("INVESTMENT_STRATEGY_JOB_MAX_RESULT_BYTES", 256 * 1024 ** 2)))
+job_strategy_workers = int(os.environ.get("INVESTMENT_STRATEGY_JOB_STRATEGY_WORKERS", 2))
+
+
 def get_all_strategies():
     """Get a dict of names and additional parameters of all strategies that are a subclass of Strategy."""
     strategies = [strategy.__name__ for strategy in Strategy.__subclasses__()]
@@ -11,18 +50,33 @@ def get_all_strategies():
 
 def get_data(ticker, period="max", item="Open", start_date=None, end_date=None):
     """Get the data as a pandas dataframe for the given ticker"""
-    tkr = yf.Ticker(ticker)
-    history_df = tkr.history(period=period)
-    if start_date or end_date:
-        history_df = filter_df_by_date(history_df, start=start_date, end=end_date)
-    history_df = remove_zero_open_data(history_df)   # Remove entries with a price of zero
-    return history_df[[item]]
+    with metrics.timer("get_data", ticker=ticker):
+        return data_cache.get_or_set((ticker, period, item, start_date, end_date), lambda: _get_data(ticker, period, item, start_date, end_date))
+
+
+def _get_data(ticker, period="max", item="Open", start_date=None, end_date=None):
+    """Download and clean the data for the given ticker"""
+    with metrics.timer("download", ticker=ticker) as timer:
+        if period == "max" and price_cache is not None:
+            history_df = price_cache.get(ticker)
+        else:
+            tkr = yf.Ticker(ticker)
+            history_df = tkr.history(period=period)
+        timer.rows = len(history_df.index)
+
+    with metrics.timer("clean", ticker=ticker) as timer:
+        if start_date or end_date:
+            history_df = filter_df_by_date(history_df, start=start_date, end=end_date)
+        history_df = remove_zero_open_data(history_df)   # Remove entries with a price of zero
+        df = history_df[[item]]
+        timer.rows = len(df.index)
+    df.attrs["ticker"] = ticker   # So indicators calculated for the data can be stored by ticker
+    return df
 
 
 def get_info(ticker):
     """Get info on a ticker"""
-    tkr = yf.Ticker(ticker)
-    return tkr.info
+    return data_cache.get_or_set((ticker, "info"), lambda: yf.Ticker(ticker).info)
 
 
 def run_strategy(df, strategy, initial_investment, regular_investment, regular_investment_frequency, start_date=None, strategy_parameters={}):
@@ -33,8 +87,259 @@ def run_strategy(df, strategy, initial_investment, regular_investment, regular_i
 
     # Check strategy exists and evaluate with df, investment and strategy parameters
     if strategy in get_all_strategies():
-        i = eval(strategy + "(df, inv, strategy_parameters=strategy_parameters, start_date=start_date)")
+        with metrics.timer("plan", strategy=strategy, ticker=df.attrs.get("ticker")) as timer:
+            i = eval(strategy + "(df, inv, strategy_parameters=strategy_parameters, start_date=start_date, indicator_store=indicator_store)")
+            timer.rows = len(df.index)
         return i.evaluate()
     else:
         print("Not a possible strategy")
 
+
+def run_strategies(df, strategies, max_workers=None, executor="thread", timeout=None, job=None):
+    """Run several strategies on a df in parallel using a thread or process pool.
+
+    Strategies is a dict of names to strategy data (as posted by the frontend). Returns a dict with the same names and
+    order, each with either the summary and results df or, if the strategy failed, timed out or was cancelled, an error
+    message. If run in a job, the job tracks the progress of each strategy and can cancel them, and the strategies run
+    on the pool for jobs rather than the pool for interactive requests.
+    """
+    pool = _get_executor(executor, max_workers, "jobs" if job is not None else "requests")
+    futures = {name: pool.submit(run_recorded, _run_strategy_data, df, strategy_data) for name, strategy_data in strategies.items()}
+    if job is not None:
+        job.track(futures)
+    wait(futures.values(), timeout=timeout)
+
+    strategy_run_data = {}
+    for name, future in futures.items():
+        if future.cancelled():
+            strategy_run_data[name] = {"error": "Strategy cancelled"}
+        elif not future.done():
+            future.cancel()
+            strategy_run_data[name] = {"error": "Strategy timed out"}
+        elif future.exception() is not None:
+            strategy_run_data[name] = {"error": str(future.exception())}
+        else:
+            summary, df_results = get_recorded_result(future.result())
+            strategy_run_data[name] = {"summary": summary, "data": df_results}
+    return strategy_run_data
+
+
+def run_strategies_job(job, ticker, strategies, executor="thread"):
+    """Run several strategies on the data for a ticker as a job in a JobQueue, on the job_strategy_workers of the pool for jobs"""
+    job.track(dict.fromkeys(strategies))
+    return run_strategies(get_data(ticker), strategies, max_workers=job_strategy_workers, executor=executor, job=job)
+
+
+_executors = {}
+_process_start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+def _get_executor(executor="thread", max_workers=None, name="requests"):
+    """Get a shared thread or process pool, creating it the first time it's used. Pools with different names aren't shared."""
+    key = (executor, max_workers, name)
+    if key not in _executors:
+        if executor == "process":
+            # Forking copies the locks of other threads as they are, so workers are started from a clean process
+            _executors[key] = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(_process_start_method))
+        elif executor == "thread":
+            _executors[key] = ThreadPoolExecutor(max_workers=max_workers)
+        else:
+            raise ValueError(f"Unknown executor {executor}, should be thread or process")
+    return _executors[key]
+
+
+def run_batch(tickers, strategies, max_workers=None, executor="thread", chunk_size=32):
+    """Run several strategies on each of a list of tickers, returning a summary table with a row per ticker and strategy.
+
+    Tickers are processed in chunks, loading the histories for a chunk in parallel and then evaluating its strategies on a
+    thread or process pool. Only the summaries are kept, so memory is bounded by the chunk size rather than the number
+    of tickers.
+    """
+    rows = []
+    for i in range(0, len(tickers), chunk_size):
+        chunk = tickers[i: i + chunk_size]
+
+        # Loading is mostly waiting on downloads so always uses threads. The memory cache is skipped so a large batch
+        # doesn't evict the data used by interactive requests.
+        with ThreadPoolExecutor(max_workers=max_workers) as loader:
+            loaded = {ticker: loader.submit(_get_data, ticker) for ticker in chunk}
+
+        pool = _get_executor(executor, max_workers)
+        futures = {}
+        for ticker, df_future in loaded.items():
+            if df_future.exception() is not None:
+                rows.extend({"ticker": ticker, "strategy": name, "error": str(df_future.exception())} for name in strategies)
+                continue
+            for name, strategy_data in strategies.items():
+                futures[(ticker, name)] = pool.submit(run_recorded, _run_strategy_summary, df_future.result(), strategy_data)
+
+        for (ticker, name), future in futures.items():
+            if future.exception() is not None:
+                rows.append({"ticker": ticker, "strategy": name, "error": str(future.exception())})
+            else:
+                rows.append({"ticker": ticker, "strategy": name, **get_recorded_result(future.result())})
+
+    return pd.DataFrame(rows)
+
+
+def run_portfolio(tickers, strategy_data, weights=None, rebalance_frequency=None, max_workers=None):
+    """Run a strategy (from strategy data, as posted by the frontend) on a portfolio of tickers with weights (a dict of
+    tickers to weights, equal if not given), rebalancing at rebalance_frequency if given. See Portfolio.evaluate."""
+    # As with batches, the memory cache is skipped so a large portfolio doesn't evict the data used by other requests
+    with ThreadPoolExecutor(max_workers=max_workers) as loader:
+        histories = dict(zip(tickers, loader.map(_get_data, tickers)))
+
+    strategy, initial_investment, regular_investment, regular_investment_frequency, start_date = parse_strategy_data(strategy_data)
+    inv = Investments(initial_investment, regular_investment, regular_investment_frequency)
+    return Portfolio(histories, weights).evaluate(_get_strategy_class(strategy), inv, strategy_parameters=strategy_data, start_date=start_date,
+        rebalance_frequency=rebalance_frequency, indicator_store=indicator_store)
+
+
+def parse_strategy_data(strategy_data):
+    """Parse strategy data (as posted by the frontend) into the strategy name, investments and start date"""
+    initial_investment = float(strategy_data["initial_investment"])
+    regular_investment = float(strategy_data["regular_investment"])
+    regular_investment_frequency = strategy_data["regular_investment_frequency"]
+    strategy = strategy_data["strategy"]
+    start_date = add_timezone_to_datetime(datetime.fromisoformat(strategy_data["start_date"]))
+    return strategy, initial_investment, regular_investment, regular_investment_frequency, start_date
+
+
+def _run_strategy_summary(df, strategy_data):
+    """Run a strategy from strategy data on a df and return only the summary"""
+    summary, _ = _run_strategy_data(df, strategy_data)
+    return summary
+
+
+def _run_strategy_data(df, strategy_data):
+    """Run a strategy from strategy data (as posted by the frontend) on a df"""
+    df = _with_own_index(df)
+    strategy, initial_investment, regular_investment, regular_investment_frequency, start_date = parse_strategy_data(strategy_data)
+    results = run_strategy(df, strategy, initial_investment, regular_investment, regular_investment_frequency, start_date, strategy_parameters=strategy_data)
+    if results is None:
+        raise ValueError(f"{strategy} is not a possible strategy or has no plan to evaluate")
+    return results
+
+
+def sweep_strategy(df, strategy, initial_investment, regular_investment, regular_investment_frequency, parameter_ranges, start_date=None,
+        strategy_parameters={}, max_workers=None, executor="thread", max_combinations=100000):
+    """Evaluate a strategy for every combination of parameter values and return the summaries ranked by percentage returns.
+
+    Parameter ranges is a dict of parameter names to either a list of values, a dict with a start, stop (inclusive) and
+    step, or a single value. Combinations are evaluated in chunks on a thread or process pool, and indicators are shared
+    through the indicator store so each combination of indicator parameters is only calculated once.
+    """
+    strategy_class = _get_strategy_class(strategy)
+    parameter_types = {parameter["name"]: parameter["type"] for parameter in strategy_class._get_additional_parameters()}
+    parameter_values = {name: expand_parameter_range(values, parameter_types.get(name)) for name, values in parameter_ranges.items()}
+
+    n_combinations = math.prod(len(values) for values in parameter_values.values())
+    if n_combinations > max_combinations:
+        raise ValueError(f"{n_combinations} parameter combinations is more than the maximum of {max_combinations}")
+    combinations = [dict(zip(parameter_values.keys(), values)) for values in itertools.product(*parameter_values.values())]
+
+    # Split into one chunk per worker
+    pool = _get_executor(executor, max_workers)
+    n_chunks = min(len(combinations), max_workers or os.cpu_count() or 1)
+    chunks = [combinations[i::n_chunks] for i in range(n_chunks)]
+    investment_args = (initial_investment, regular_investment, regular_investment_frequency)
+    futures = [pool.submit(run_recorded, _sweep_chunk, df, strategy, investment_args, start_date, strategy_parameters, chunk) for chunk in chunks]
+
+    results = [result for future in futures for result in get_recorded_result(future.result())]
+    return sorted(results, key=lambda result: result["summary"]["percentage_returns"] if "summary" in result else -math.inf, reverse=True)
+
+
+def simulate_strategy(df, strategy_data, n_paths=1000, years=20, method="bootstrap", block_size=20, seed=None, max_workers=None, executor="process",
+        max_paths=100000):
+    """Run a strategy (from strategy data, as posted by the frontend) over simulated future price paths for a df.
+
+    Returns the distribution of the percentage returns and maximum drawdown over the paths, see simulation.simulate_strategy.
+    Paths are evaluated in chunks on a thread or process pool.
+    """
+    if n_paths > max_paths:
+        raise ValueError(f"{n_paths} paths is more than the maximum of {max_paths}")
+    strategy, initial_investment, regular_investment, regular_investment_frequency, _ = parse_strategy_data(strategy_data)
+    return simulation.simulate_strategy(df, _get_strategy_class(strategy), (initial_investment, regular_investment, regular_investment_frequency),
+        strategy_parameters=strategy_data, n_paths=n_paths, years=years, method=method, block_size=block_size, seed=seed,
+        pool=_get_executor(executor, max_workers))
+
+
+def walk_forward_strategy(df, strategy_data, horizon_years=10, frequency="months", max_workers=None, executor="thread"):
+    """Evaluate a strategy (from strategy data, as posted by the frontend) for windows of horizon_years starting on a schedule.
+
+    The first window starts at the start date of the strategy data and then at the given frequency. Windows are evaluated
+    in chunks on a thread or process pool, sharing indicators within each chunk and through the indicator store. Returns a
+    table of the start and end date, total invested, value and returns of each window.
+    """
+    strategy, initial_investment, regular_investment, regular_investment_frequency, start_date = parse_strategy_data(strategy_data)
+    strategy_class = _get_strategy_class(strategy)
+    starts, ends = walk_forward.get_windows(df, horizon_years, frequency, max(start_date, df.index[0]))
+
+    pool = _get_executor(executor, max_workers)
+    n_chunks = max(min(len(starts), max_workers or os.cpu_count() or 1), 1)
+    investment_args = (initial_investment, regular_investment, regular_investment_frequency)
+    futures = [pool.submit(run_recorded, _walk_forward_chunk, df, strategy_class, investment_args, strategy_data, chunk_starts, chunk_ends)
+        for chunk_starts, chunk_ends in zip(np.array_split(starts, n_chunks), np.array_split(ends, n_chunks))]
+    return walk_forward.to_table([row for future in futures for row in get_recorded_result(future.result())])
+
+
+def _walk_forward_chunk(df, strategy_class, investment_args, strategy_parameters, starts, ends):
+    """Evaluate a strategy for a chunk of walk forward windows"""
+    return walk_forward.evaluate_windows(_with_own_index(df), strategy_class, investment_args, strategy_parameters, starts, ends,
+        indicator_store=indicator_store)
+
+
+def expand_parameter_range(values, parameter_type=None):
+    """Expand a parameter range, given as a list, a dict with a start, stop (inclusive) and step, or a single value"""
+    if isinstance(values, dict):
+        for key in ("start", "stop", "step"):
+            if isinstance(values.get(key), bool) or not isinstance(values.get(key), (int, float)):
+                raise ValueError(f"Parameter ranges need a number for {key}, not {values.get(key)!r}")
+        if values["step"] <= 0 or values["stop"] < values["start"]:
+            raise ValueError(f"Parameter ranges need a positive step and a stop which isn't before the start, not {values}")
+        n_steps = math.floor((values["stop"] - values["start"]) / values["step"] + 1e-9)
+        values = (values["start"] + values["step"] * np.arange(n_steps + 1)).tolist()
+    elif not isinstance(values, (list, tuple)):
+        values = [values]
+    elif len(values) == 0:
+        raise ValueError("Parameter ranges need at least one value")
+
+    if parameter_type == "integer":
+        return list(dict.fromkeys(int(round(value)) for value in values))
+    return [float(value) if parameter_type == "number" else value for value in values]
+
+
+def _get_strategy_class(strategy):
+    """Get a strategy class from its (string) name"""
+    strategies = {strategy_class.__name__: strategy_class for strategy_class in Strategy.__subclasses__()}
+    if strategy not in strategies:
+        raise ValueError(f"{strategy} is not a possible strategy")
+    return strategies[strategy]
+
+
+def _sweep_chunk(df, strategy, investment_args, start_date, strategy_parameters, combinations):
+    """Evaluate a strategy for a chunk of parameter combinations, sharing indicators between them"""
+    strategy_class = _get_strategy_class(strategy)
+    df = _with_own_index(df)
+    results = []
+    for parameters in combinations:
+        try:
+            inv = Investments(*investment_args)
+            i = strategy_class(df, inv, strategy_parameters={**strategy_parameters, **parameters}, start_date=start_date, indicator_store=indicator_store)
+            summary, _ = i.evaluate()
+            results.append({"parameters": parameters, "summary": summary})
+        except Exception as e:
+            results.append({"parameters": parameters, "error": str(e)})
+    return results
+
+
+def _with_own_index(df):
+    """Get a shallow copy of a df with its own index and columns.
+
+    Indexes build their lookup tables lazily and this isn't thread safe, so dfs shared between threads need their own.
+    Shallow copies of an index share its lookup table, so they're deep copies.
+    """
+    df = df.copy(deep=False)
+    df.index = df.index.copy(deep=True)
+    df.columns = df.columns.copy(deep=True)
+    return df
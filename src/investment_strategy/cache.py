@@ -0,0 +1,337 @@
+import copy
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from urllib.parse import quote
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+
+def yfinance_downloader(ticker, start=None):
+    """Download the price history for a ticker from Yahoo Finance, either the full history or from a start date"""
+    tkr = yf.Ticker(ticker)
+    if start is None:
+        return tkr.history(period="max")
+    else:
+        return tkr.history(start=start.strftime('%Y-%m-%d'))
+
+
+class PriceHistoryCache:
+    """A persistent on-disk cache of price histories keyed by ticker.
+
+    Each ticker is stored as memory-mapped NumPy arrays (the index as int64 nanoseconds and the numeric columns as a 2D
+    float64 array) alongside a small json file of metadata. Entries older than ttl seconds are refreshed by downloading
+    only the bars since the last cached bar. When the cache grows beyond max_bytes the least recently used entries are
+    evicted. The sizes and order of use of the entries are kept in memory, read from the directory once at startup, so
+    entries written by other processes sharing the directory are only counted after a restart. The downloader is any
+    callable taking a ticker and an optional start date and returning a price df.
+    """
+    def __init__(self, directory, downloader=yfinance_downloader, ttl=12 * 60 * 60, max_bytes=512 * 1024 ** 2):
+        self.directory = directory
+        self.downloader = downloader
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.counters = {"hits": 0, "misses": 0, "refreshes": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        self._locks = {}
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Directory names of the entries to their size, from least to most recently used
+        self._sizes = OrderedDict((entry["name"], entry["nbytes"]) for entry in sorted(self._entries(), key=lambda entry: entry["last_access"]))
+        self._nbytes = sum(self._sizes.values())
+
+    def get(self, ticker):
+        """Get the price history for a ticker, downloading only what is missing from the cache"""
+        with self._get_lock(self._name(ticker)):
+            meta = self._read_meta(ticker)
+
+            if meta is not None and time.time() - meta["fetched_at"] < self.ttl:
+                self._count("hits")
+                return self._read(ticker, meta)
+
+            if meta is None:
+                self._count("misses")
+                df = self.downloader(ticker)
+            else:
+                self._count("refreshes")
+                df = self._refresh(ticker, self._read(ticker, meta))
+
+            # Don't cache failed downloads, e.g., for tickers which don't exist
+            if len(df) > 0:
+                self._write(ticker, df, meta)
+
+        self._evict()
+        return df
+
+    def invalidate(self, ticker):
+        """Remove a ticker from the cache"""
+        with self._get_lock(self._name(ticker)):
+            self._remove(self._name(ticker))
+
+    def stats(self):
+        """Return the cache counters and current size"""
+        with self._lock:
+            counters = dict(self.counters)
+            counters.update({"entries": len(self._sizes), "bytes": self._nbytes})
+        return counters
+
+    def _refresh(self, ticker, cached_df):
+        """Download the bars since the last cached bar and append them to the cached df"""
+        new_df = self.downloader(ticker, start=cached_df.index[-1])
+        if len(new_df) == 0:
+            return cached_df
+
+        # The last cached bar may have been incomplete, so anything from the first new bar onwards is replaced
+        new_df = new_df[cached_df.columns.intersection(new_df.columns)]
+        appended_df = new_df[new_df.index > cached_df.index[-1]]
+
+        # Dividends and splits adjust the whole history, so the cached bars are stale and everything is downloaded again
+        for column in ["Dividends", "Stock Splits"]:
+            if column in appended_df and (appended_df[column] != 0).any():
+                return self.downloader(ticker)
+
+        return pd.concat([cached_df[cached_df.index < new_df.index[0]], new_df])
+
+    def _get_lock(self, name):
+        """Get the lock for a cached entry by its directory name"""
+        with self._lock:
+            return self._locks.setdefault(name, threading.Lock())
+
+    def _count(self, counter, n=1):
+        with self._lock:
+            self.counters[counter] += n
+
+    @staticmethod
+    def _name(ticker):
+        """Directory name for a ticker, escaping characters such as ^ and / used in some tickers"""
+        return quote(ticker, safe="")
+
+    def _path(self, ticker, filename=""):
+        return os.path.join(self.directory, self._name(ticker), filename)
+
+    def _read_meta(self, ticker):
+        try:
+            with open(self._path(ticker, "meta.json")) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _read(self, ticker, meta):
+        """Read a cached df from the memory-mapped arrays"""
+        index = np.load(self._path(ticker, meta["index_file"]), mmap_mode="r")
+        values = np.load(self._path(ticker, meta["values_file"]), mmap_mode="r")
+        os.utime(self._path(ticker, "meta.json"))   # Mark as recently used for eviction, after a restart too
+        self._track(self._name(ticker), meta["nbytes"])
+
+        df_index = pd.DatetimeIndex(pd.to_datetime(np.asarray(index), utc=True), name=meta["index_name"])
+        if meta["tz"] is None:
+            df_index = df_index.tz_localize(None)
+        else:
+            df_index = df_index.tz_convert(meta["tz"])
+        df = pd.DataFrame(values, index=df_index, columns=meta["columns"], copy=False)
+        return df.astype(meta["dtypes"], copy=False)
+
+    def _write(self, ticker, df, meta=None):
+        """Write a df to the cache, replacing any existing entry"""
+        df = df.select_dtypes("number")
+        version = uuid.uuid4().hex
+        new_meta = {
+            "index_file": f"index-{version}.npy",
+            "values_file": f"values-{version}.npy",
+            "index_name": df.index.name,
+            "tz": str(df.index.tz) if df.index.tz is not None else None,
+            "columns": list(df.columns),
+            "dtypes": {column: str(dtype) for column, dtype in df.dtypes.items()},
+            "fetched_at": time.time()
+        }
+
+        os.makedirs(self._path(ticker), exist_ok=True)
+        index = df.index.tz_convert("UTC") if df.index.tz is not None else df.index
+        np.save(self._path(ticker, new_meta["index_file"]), index.asi8)
+        np.save(self._path(ticker, new_meta["values_file"]), df.to_numpy(dtype=float))
+        new_meta["nbytes"] = os.path.getsize(self._path(ticker, new_meta["index_file"])) + os.path.getsize(self._path(ticker, new_meta["values_file"]))
+
+        # Swap the metadata atomically so readers only see complete entries, then remove the old arrays
+        tmp_meta_path = self._path(ticker, f"meta-{version}.json")
+        with open(tmp_meta_path, "w") as f:
+            json.dump(new_meta, f)
+        os.replace(tmp_meta_path, self._path(ticker, "meta.json"))
+
+        self._track(self._name(ticker), new_meta["nbytes"])
+
+        if meta is not None:
+            for filename in [meta["index_file"], meta["values_file"]]:
+                try:
+                    os.remove(self._path(ticker, filename))
+                except OSError:
+                    pass
+
+    def _entries(self):
+        """List the cached entries on disk with their size and last access time"""
+        entries = []
+        for name in os.listdir(self.directory):
+            meta_path = os.path.join(self.directory, name, "meta.json")
+            try:
+                with open(meta_path) as f:
+                    nbytes = json.load(f)["nbytes"]
+                entries.append({"name": name, "nbytes": nbytes, "last_access": os.path.getmtime(meta_path)})
+            except (FileNotFoundError, NotADirectoryError, json.JSONDecodeError, KeyError):
+                continue
+        return entries
+
+    def _evict(self):
+        """Evict the least recently used entries until the cache fits in max_bytes"""
+        with self._lock:
+            evicted = []
+            total_bytes = self._nbytes
+            # Always keep the most recently used entry, even if it is larger than max_bytes by itself
+            for name, nbytes in self._sizes.items():
+                if total_bytes <= self.max_bytes or len(evicted) == len(self._sizes) - 1:
+                    break
+                evicted.append(name)
+                total_bytes -= nbytes
+
+        for name in evicted:
+            with self._get_lock(name):
+                self._remove(name)
+            self._count("evictions")
+
+    def _track(self, name, nbytes):
+        """Record the size of an entry and mark it as the most recently used"""
+        with self._lock:
+            self._nbytes += nbytes - self._sizes.get(name, 0)
+            self._sizes[name] = nbytes
+            self._sizes.move_to_end(name)
+
+    def _remove(self, name):
+        """Remove a cached entry by its directory name"""
+        with self._lock:
+            self._nbytes -= self._sizes.pop(name, 0)
+        directory = os.path.join(self.directory, name)
+        if not os.path.isdir(directory):
+            return
+        for filename in os.listdir(directory):
+            os.remove(os.path.join(directory, filename))
+        os.rmdir(directory)
+
+
+class LRUCache:
+    """A thread-safe, bounded, in-memory least recently used cache.
+
+    Entries are evicted once there are more than max_entries or their estimated size is more than max_bytes, and expire
+    after ttl seconds. Cached dfs are stored with read-only arrays and returned as shallow copies, so callers can add
+    columns but can't modify the cached values; other values are returned as deep copies.
+    """
+    def __init__(self, max_entries=128, max_bytes=256 * 1024 ** 2, ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0}
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}   # Keys being got to their lock and the number of callers using it
+
+    def get_or_set(self, key, func):
+        """Get the value for a key, calling func to create and cache it if it isn't cached"""
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            key_lock[1] += 1
+
+        # Only one caller creates the value for a key, others wait for it rather than repeating the work
+        try:
+            with key_lock[0]:
+                found, value = self._get(key)
+                if found:
+                    return value
+
+                return self._view(self._set(key, func()))
+        finally:
+            # Remove the lock once no callers are using it, so there are only locks for keys being got
+            with self._lock:
+                key_lock[1] -= 1
+                if key_lock[1] == 0:
+                    del self._key_locks[key]
+
+    def invalidate(self, key):
+        """Remove a key from the cache"""
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        """Remove all keys from the cache"""
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def stats(self):
+        """Return the cache counters and current size"""
+        with self._lock:
+            return dict(self.counters, entries=len(self._entries), bytes=self._nbytes)
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.time() - entry["created_at"] >= self.ttl:
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.counters["misses"] += 1
+                return False, None
+
+            self.counters["hits"] += 1
+            self._entries.move_to_end(key)
+            return True, self._view(entry["value"])
+
+    def _set(self, key, value):
+        value = self._freeze(value)
+        nbytes = self._estimate_size(value)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = {"value": value, "nbytes": nbytes, "created_at": time.time()}
+            self._nbytes += nbytes
+
+            # Evict least recently used entries, always keeping the newest one
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._nbytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.counters["evictions"] += 1
+        return value
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._nbytes -= entry["nbytes"]
+
+    @staticmethod
+    def _can_freeze(value):
+        """Whether a value is a df which can be stored as a single read-only array, i.e., it has one numeric dtype"""
+        return isinstance(value, pd.DataFrame) and value.shape[1] > 0 and len(set(value.dtypes)) == 1 and value.dtypes.iloc[0] != object
+
+    @classmethod
+    def _freeze(cls, value):
+        """Copy a df into a single read-only array where possible"""
+        if cls._can_freeze(value):
+            values = value.to_numpy(copy=True)
+            values.flags.writeable = False
+            frozen = pd.DataFrame(values, index=value.index, columns=value.columns, copy=False)
+            frozen.attrs = value.attrs
+            return frozen
+        return value
+
+    @classmethod
+    def _view(cls, value):
+        """Return a view of a cached value which can't be used to change the cached value"""
+        if cls._can_freeze(value):
+            return value.copy(deep=False)
+        return copy.deepcopy(value)
+
+    @staticmethod
+    def _estimate_size(value):
+        if isinstance(value, pd.DataFrame):
+            return int(value.memory_usage(index=True, deep=True).sum())
+        return len(json.dumps(value, default=str))
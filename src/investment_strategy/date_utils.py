@@ -1,14 +1,26 @@
+from functools import lru_cache
+import numpy as np
+import pandas as pd
 import pytz
 from dateutil.relativedelta import relativedelta
 
 
 def convert_datetime_index_to_str(df, format="long"):
     """Convert datetime index to string time in the required format"""
-    dt_format = get_datetime_format(format)
-    df.index = df.index.strftime(dt_format)
+    df.index = format_datetime_index(df.index, format)
     return df
 
 
+def format_datetime_index(index, format="long"):
+    """Format a datetime index as an array of strings in the required format"""
+    if format == "short":
+        # Format the local dates in one go rather than calling strftime for each date
+        local_index = index.tz_localize(None) if index.tz is not None else index
+        return np.datetime_as_string(local_index.values, unit="D").astype(object)
+    else:
+        return index.strftime(get_datetime_format(format)).values
+
+
 def get_datetime_format(format="long"):
     """Return a datetime format, either short (date) or long (data and time)"""
     if format == "short":
@@ -42,18 +54,81 @@ def date_frequency_to_schedule_intervals(frequency="months"):
 
 
 def get_schedule(start, end, intervals, ignore_first_date=False):
-    """Get a datetime schedule from a start and end date and a set of intervals"""
+    """Get a datetime schedule from a start and end date and a set of intervals, as a DatetimeIndex"""
+    intervals = (intervals["years"], intervals["months"], intervals["weeks"], intervals["days"])
+    # Equal datetimes in different timezones give different schedules, so the timezone is part of the cache key
+    return _get_schedule(start, end, intervals, ignore_first_date, repr(getattr(start, "tzinfo", None)))
+
+
+def get_schedule_positions(index, schedule):
+    """Get the positions of the rows in a datetime index that investments on a schedule are made at, the last row before each date"""
+    return get_nearest_date_positions(index, schedule, past_only=True)
+
+
+@lru_cache(maxsize=1024)
+def _get_schedule(start, end, intervals, ignore_first_date=False, tz=None):
+    """Get a datetime schedule, cached as many strategies and tickers share the same schedule.
+
+    The schedule is the same as adding a relativedelta of the intervals to the start date again and again. Days and weeks
+    move on by a fixed amount of time. Months and years move on by calendar month keeping the local time and the day
+    of the month, but clamping it to the end of shorter months, and clamped days stick, e.g., Jan 31, Feb 28, Mar 28.
+    Schedules of pandas Timestamps are calculated with arrays, anything else (or local times which are ambiguous or don't
+    exist, which arrays can't match) uses the loop.
+    """
+    years, months, weeks, days = intervals
+    if not any(intervals) or min(intervals) < 0:
+        raise ValueError(f"Schedule intervals must move the date forward, not {intervals}")
+
+    if isinstance(start, pd.Timestamp) and isinstance(end, pd.Timestamp):
+        try:
+            if not (weeks or days):
+                return _get_calendar_schedule(start, end, years * 12 + months, ignore_first_date)
+            elif not (years or months):
+                return _get_fixed_schedule(start, end, pd.Timedelta(weeks=weeks, days=days).value, ignore_first_date)
+        except (pytz.exceptions.InvalidTimeError, ValueError):
+            pass
+
     schedule = []
     date = start
 
     if ignore_first_date:
-        date += relativedelta(years=intervals["years"], months=intervals["months"], weeks=intervals["weeks"], days=intervals["days"])
+        date += relativedelta(years=years, months=months, weeks=weeks, days=days)
 
     while date <= end:
         schedule.append(date)
-        date += relativedelta(years=intervals["years"], months=intervals["months"], weeks=intervals["weeks"], days=intervals["days"])
+        date += relativedelta(years=years, months=months, weeks=weeks, days=days)
         
-    return schedule
+    return pd.DatetimeIndex(schedule)
+
+
+def _get_calendar_schedule(start, end, months, ignore_first_date=False):
+    """Get a schedule of Timestamps every number of months from start to end"""
+    local_start = start.tz_localize(None)
+    local_end = end.tz_convert(start.tz).tz_localize(None) if start.tz is not None and end.tz is not None else end
+    first_month = local_start.year * 12 + local_start.month - 1
+    n_steps = ((local_end.year * 12 + local_end.month - 1) - first_month) // months + 1
+
+    # Months from the start, with the day clamped to the shortest month so far
+    month_starts = (first_month - 1970 * 12 + months * np.arange(max(n_steps, 0) + 1)).astype("datetime64[M]").astype("datetime64[D]")
+    days_in_month = (month_starts.astype("datetime64[M]") + 1).astype("datetime64[D]") - month_starts
+    day = np.minimum.accumulate(np.minimum(days_in_month.astype(np.int64), local_start.day))
+    local_dates = (month_starts + (day - 1)).astype("datetime64[ns]") + (local_start - local_start.normalize()).to_timedelta64()
+
+    schedule = pd.DatetimeIndex(local_dates)
+    if start.tz is not None:
+        schedule = schedule.tz_localize(start.tz, ambiguous="raise", nonexistent="raise")
+    if ignore_first_date:
+        schedule = schedule[1:]
+    return schedule[schedule <= end]
+
+
+def _get_fixed_schedule(start, end, step, ignore_first_date=False):
+    """Get a schedule of Timestamps every step nanoseconds from start to end"""
+    n_steps = (end.value - start.value) // step
+    values = start.value + step * np.arange(1 if ignore_first_date else 0, max(n_steps, -1) + 1, dtype=np.int64)
+    if start.tz is None:
+        return pd.DatetimeIndex(values.view("datetime64[ns]"))
+    return pd.DatetimeIndex(values.view("datetime64[ns]")).tz_localize("UTC").tz_convert(start.tz)
 
 
 def get_nearest_date(dates, date):
@@ -71,9 +146,71 @@ def get_nearest_date_future(dates, date):
 
 def get_nearest_date_in_df(df, date, past_only=False, future_only=False):
     """Get the nearest date in a df with dates as the index"""
+    return df.index[get_nearest_date_positions(df.index, [date], past_only=past_only, future_only=future_only)[0]]
+
+
+def get_nearest_dates_in_df(df, dates, past_only=False, future_only=False):
+    """Get the nearest date in a df with dates as the index for each of a list of dates"""
+    return df.index[get_nearest_date_positions(df.index, dates, past_only=past_only, future_only=future_only)]
+
+
+def get_nearest_date_positions(index, dates, past_only=False, future_only=False, is_sorted=False):
+    """Get the positions in a datetime index of the nearest dates to each of a list of dates.
+
+    Uses a binary search over the index, sorting it first unless it's sorted, which is only checked if is_sorted is
+    False. Matches get_nearest_date, get_nearest_date_past and get_nearest_date_future, i.e., past and future only
+    dates are strictly before or after the date, and the first date in the index is used when there isn't one.
+    """
+    dates = _to_datetime_index(dates)
+    if len(dates) == 0:
+        return np.array([], dtype=int)
+    elif index.tz is not None and dates.tz is not None:
+        dates = dates.tz_convert(index.tz)
+    elif (index.tz is None) != (dates.tz is None):
+        raise TypeError("Cannot compare tz-naive and tz-aware datetimes")
+
+    index_values = index.asi8
+    date_values = dates.asi8
+    sorter = None if is_sorted or index.is_monotonic_increasing else np.argsort(index_values, kind="stable")
+
     if future_only:
-        return df.loc[df.index == get_nearest_date_future(df.index.to_list(), date)].index[0]
+        positions = np.searchsorted(index_values, date_values, side="right", sorter=sorter)
+        missing = positions >= len(index_values)
     elif past_only:
-        return df.loc[df.index == get_nearest_date_past(df.index.to_list(), date)].index[0]
+        positions = np.searchsorted(index_values, date_values, side="left", sorter=sorter) - 1
+        missing = positions < 0
     else:
-        return df.loc[df.index == get_nearest_date(df.index.to_list(), date)].index[0]
+        after = np.searchsorted(index_values, date_values, side="left", sorter=sorter)
+        before = np.clip(after - 1, 0, len(index_values) - 1)
+        after = np.clip(after, 0, len(index_values) - 1)
+        if sorter is not None:
+            before, after = sorter[before], sorter[after]
+        # Earlier date wins a tie, as in get_nearest_date
+        use_before = np.abs(date_values - index_values[before]) <= np.abs(index_values[after] - date_values)
+        return np.where(use_before, before, after)
+
+    # The first row, rather than the earliest date, is used when there isn't a date before or after
+    positions[missing] = 0
+    if sorter is not None:
+        positions = sorter[positions]
+        positions[missing] = 0
+    return positions
+
+
+def _to_datetime_index(dates):
+    """Convert dates to a DatetimeIndex, with a fast path for lists of pandas Timestamps such as the dates in a plan"""
+    if isinstance(dates, pd.DatetimeIndex):
+        return dates
+    dates = list(dates)
+
+    # Building the index from the nanosecond values skips inferring the type of each date, which is slow
+    if len(dates) > 0 and all(type(date) is pd.Timestamp for date in dates):
+        tz_aware = {date.tz is not None for date in dates}
+        if len(tz_aware) == 1:
+            index = pd.DatetimeIndex(np.fromiter((date.value for date in dates), dtype=np.int64, count=len(dates)).view("datetime64[ns]"))
+            return index.tz_localize("UTC") if tz_aware.pop() else index
+
+    try:
+        return pd.DatetimeIndex(dates)
+    except (ValueError, TypeError):
+        return pd.to_datetime(dates, utc=True)   # Dates in a mix of timezones
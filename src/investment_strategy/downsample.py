@@ -0,0 +1,60 @@
+import numpy as np
+
+
+def lttb_indices(x, y, n_points):
+    """Get the indices of the points chosen by largest-triangle-three-buckets (LTTB) to represent a series with n_points"""
+    n = len(x)
+    n_points = max(n_points, 3)   # Always the first, last and at least one point between
+    if n_points >= n:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.nan_to_num(np.asarray(y, dtype=float))
+
+    # The first and last points are always kept, the rest are split into n_points - 2 buckets
+    bucket_edges = (np.floor(np.arange(n_points - 1) * (n - 2) / (n_points - 2)) + 1).astype(int)
+    bucket_edges[-1] = n - 1
+
+    indices = np.empty(n_points, dtype=int)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+    for i in range(n_points - 2):
+        start, end = bucket_edges[i], bucket_edges[i + 1]
+
+        # Average of the next bucket, or the last point for the last bucket
+        next_start, next_end = end, bucket_edges[i + 2] if i + 2 < len(bucket_edges) else n
+        average_x = x[next_start: next_end].mean()
+        average_y = y[next_start: next_end].mean()
+
+        # Choose the point in this bucket making the largest triangle with the previous chosen point and the next average
+        areas = np.abs((x[a] - average_x) * (y[start: end] - y[a]) - (x[a] - x[start: end]) * (average_y - y[a]))
+        a = start + int(np.argmax(areas))
+        indices[i + 1] = a
+
+    return indices
+
+
+def downsample_df(df, max_points, columns=("Open", "total_value", "returns"), keep_column="investment"):
+    """Downsample a df to about max_points rows for charting.
+
+    Rows are chosen with LTTB for each of the columns in the df, sharing max_points between them. Every row where
+    keep_column is greater than 0 is always kept, e.g., so investments are shown on the dates they were made.
+    """
+    if max_points is None or len(df.index) <= max_points:
+        return df
+
+    keep = np.zeros(len(df.index), dtype=bool)
+    if keep_column in df:
+        keep |= df[keep_column].to_numpy() > 0
+
+    columns = [column for column in columns if column in df]
+    if columns:
+        n_points = max((max_points - keep.sum()) // len(columns), 3)
+        x = df.index.asi8 if hasattr(df.index, "asi8") else np.arange(len(df.index))
+        for column in columns:
+            keep[lttb_indices(x, df[column].to_numpy(), n_points)] = True
+    else:
+        keep[np.linspace(0, len(df.index) - 1, max_points).astype(int)] = True
+
+    return df[keep]
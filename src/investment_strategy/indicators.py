@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import uuid
+from urllib.parse import quote
+import numpy as np
+import pandas as pd
+from investment_strategy.cache import LRUCache
+from investment_strategy.strategies_utils import get_velocity_data, get_velocity_data_with_drag
+
+
+# Indicators strategies can request by name, each a function of a price df and parameters returning a df with the same index
+INDICATORS = {"velocity": get_velocity_data, "velocity_with_drag": get_velocity_data_with_drag}
+
+
+def get_data_version(df, columns=("Open",)):
+    """Get a fingerprint of the dates and prices in a df, which changes whenever the data does"""
+    hashes = pd.util.hash_pandas_object(df[list(columns)], index=True).to_numpy()
+    return hashlib.blake2b(np.ascontiguousarray(hashes), digest_size=16).hexdigest()
+
+
+class IndicatorStore:
+    """A store of indicators calculated for price data, shared between strategies and requests.
+
+    Indicators are keyed by the ticker (from the df attrs, if known), a fingerprint of the price data, the indicator
+    name and its parameters, so each one is only calculated once for a version of the data. They're kept in memory in an
+    LRUCache and, if a directory is given, persisted there so they are reused between processes and restarts. Only the
+    latest version of an indicator is persisted for each ticker, and only for dfs with a known ticker.
+    """
+    def __init__(self, directory=None, max_entries=256, max_bytes=256 * 1024 ** 2):
+        self.directory = directory
+        self.cache = LRUCache(max_entries=max_entries, max_bytes=max_bytes)
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def get(self, df, name, **parameters):
+        """Get the indicators called name with parameters for a df, calculating them only if they aren't stored"""
+        if name not in INDICATORS:
+            raise ValueError(f"{name} is not a possible indicator")
+
+        key = (df.attrs.get("ticker"), get_data_version(df), name, tuple(sorted(parameters.items())))
+        indicators = self.cache.get_or_set(key, lambda: self._load_or_calculate(df, key, parameters))
+
+        # Use the index of the df rather than the stored one, as indexes shared between threads aren't thread safe
+        indicators.index = df.index
+        return indicators
+
+    def clear(self):
+        """Remove all indicators from memory, persisted indicators are kept"""
+        self.cache.clear()
+
+    def stats(self):
+        """Return the counters and size of the indicators in memory"""
+        return self.cache.stats()
+
+    def _load_or_calculate(self, df, key, parameters):
+        path = self._path(key)
+        if path is not None and os.path.exists(path):
+            try:
+                with np.load(path, allow_pickle=False) as persisted:
+                    return pd.DataFrame(persisted["values"], index=df.index, columns=persisted["columns"].tolist())
+            except (OSError, ValueError, KeyError):
+                pass
+
+        indicators = INDICATORS[key[2]](df, **parameters)
+        if path is not None:
+            self._write(path, indicators)
+        return indicators
+
+    def _path(self, key):
+        """Path of a persisted indicator, named by indicator, parameters and data version, or None if not persisted"""
+        ticker, version, name, parameters = key
+        if self.directory is None or ticker is None:
+            return None
+        parameters_hash = hashlib.blake2b(json.dumps(parameters, default=str).encode(), digest_size=8).hexdigest()
+        return os.path.join(self.directory, quote(ticker, safe=""), f"{name}-{parameters_hash}-{version}.npz")
+
+    @staticmethod
+    def _write(path, indicators):
+        """Write indicators atomically, removing other versions of the same indicator"""
+        directory, filename = os.path.split(path)
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = os.path.join(directory, f"tmp-{uuid.uuid4().hex}.npz")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, values=indicators.to_numpy(dtype=float), columns=np.array(indicators.columns, dtype=str))
+        os.replace(tmp_path, path)
+
+        prefix = filename.rsplit("-", 1)[0] + "-"
+        for other in os.listdir(directory):
+            if other.startswith(prefix) and other != filename:
+                try:
+                    os.remove(os.path.join(directory, other))
+                except OSError:
+                    pass
@@ -0,0 +1,167 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job:
+    """A function run in the background by a JobQueue, with its status, result and the progress of its parts"""
+    def __init__(self, key=None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = "queued"   # queued, running, done, failed or cancelled
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.nbytes = 0   # Estimated size of the result
+        self.parts = {}   # Names of the parts of the job, e.g., strategies, to their futures once they're submitted
+        self.cancelled = threading.Event()
+        self.future = None
+
+    def track(self, futures):
+        """Report the progress of the parts of the job with their futures, cancelling them if the job has been cancelled"""
+        self.parts = dict(futures)
+        if self.cancelled.is_set():
+            self._cancel_parts()
+
+    def progress(self):
+        """Get the status of each part of the job"""
+        return {name: _future_status(future) for name, future in self.parts.items()}
+
+    def in_flight(self):
+        return self.status in ("queued", "running")
+
+    def summary(self):
+        return {"job_id": self.id, "status": self.status, "progress": self.progress(), "created_at": self.created_at,
+            "finished_at": self.finished_at, "error": self.error}
+
+    def _cancel_parts(self):
+        for future in self.parts.values():
+            if future is not None:
+                future.cancel()
+
+
+def _future_status(future):
+    if future is None or not (future.running() or future.done()):
+        return "queued"
+    elif future.running():
+        return "running"
+    elif future.cancelled():
+        return "cancelled"
+    elif future.exception() is not None:
+        return "failed"
+    return "done"
+
+
+def estimate_size(value):
+    """Estimate the size in bytes of a result, counting the arrays of any pandas objects in dicts, lists and tuples"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True).sum())
+    elif isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True))
+    elif isinstance(value, dict):
+        return sum(estimate_size(item) for item in value.values())
+    elif isinstance(value, (list, tuple)):
+        return sum(estimate_size(item) for item in value)
+    return 64   # Rough size of a small value such as a number or string
+
+
+class JobQueue:
+    """An in-process queue of jobs run on a bounded pool of threads.
+
+    Jobs are functions taking the job (to report progress and check for cancellation) and some arguments. Submitting
+    a job with the same key as one which is queued or running returns that job rather than running it again. Finished
+    jobs, and their results, are kept for ttl seconds, at most max_jobs of them are kept and the oldest are removed once
+    their results are more than max_result_bytes, always keeping the newest. Jobs are only shared within a process, so
+    with several server processes the job should be fetched from the process which ran it.
+    """
+    def __init__(self, max_workers=2, max_queued=64, max_jobs=256, ttl=60 * 60, max_result_bytes=256 * 1024 ** 2):
+        self.max_queued = max_queued
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self.max_result_bytes = max_result_bytes
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, key=None):
+        """Queue func(job, *args) to run in the background, returning the job"""
+        with self._lock:
+            self._expire()
+            in_flight = [job for job in self.jobs.values() if job.in_flight()]
+            if key is not None:
+                for job in in_flight:
+                    if job.key == key:
+                        return job
+            if len(in_flight) >= self.max_queued:
+                raise JobQueueFull(f"There are already {len(in_flight)} jobs queued or running")
+
+            job = Job(key)
+            self.jobs[job.id] = job
+            job.future = self.pool.submit(self._run, job, func, args)
+        return job
+
+    def get(self, job_id):
+        """Get a job by its id, or None if it doesn't exist or has expired"""
+        with self._lock:
+            self._expire()
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a job, returning it or None if it doesn't exist. Parts of the job which have already started still finish."""
+        job = self.get(job_id)
+        if job is not None and job.in_flight():
+            job.cancelled.set()
+            job.future.cancel()
+            job._cancel_parts()
+            self._finish(job, "cancelled")
+        return job
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self.jobs.values()]
+        return {status: statuses.count(status) for status in ("queued", "running", "done", "failed", "cancelled")}
+
+    def _run(self, job, func, args):
+        # Cancelling sets the status under the lock too, so a job cancelled before it starts is never marked as running
+        with self._lock:
+            if job.cancelled.is_set() or job.finished_at is not None:
+                return
+            job.status = "running"
+        try:
+            result = func(job, *args)
+        except Exception as e:
+            job.error = str(e)
+            self._finish(job, "failed")
+        else:
+            if not job.cancelled.is_set():
+                job.result = result
+                job.nbytes = estimate_size(result)
+                self._finish(job, "done")
+
+    def _finish(self, job, status):
+        with self._lock:
+            if job.finished_at is None:
+                job.status = status
+                job.finished_at = time.time()
+
+    def _expire(self):
+        """Remove finished jobs older than ttl, and the oldest finished jobs beyond max_jobs or max_result_bytes"""
+        finished = sorted((job for job in self.jobs.values() if job.finished_at is not None), key=lambda job: job.finished_at)
+        n_jobs = len(finished)
+        nbytes = sum(job.nbytes for job in finished)
+        for job in finished[:-1]:
+            if time.time() - job.finished_at <= self.ttl and n_jobs <= self.max_jobs and nbytes <= self.max_result_bytes:
+                break
+            del self.jobs[job.id]
+            n_jobs -= 1
+            nbytes -= job.nbytes
+        if finished and time.time() - finished[-1].finished_at > self.ttl:
+            del self.jobs[finished[-1].id]
@@ -0,0 +1,196 @@
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class Recorder:
+    """Timings of stages, aggregated by stage, strategy and ticker with the number of calls, total and max seconds and rows"""
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, seconds, rows=None, count=1, max_seconds=None):
+        with self._lock:
+            entry = self.stages.setdefault(key, [0, 0.0, 0.0, 0])
+            entry[0] += count
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds if max_seconds is None else max_seconds)
+            entry[3] += rows or 0
+
+    def merge(self, stages):
+        """Add the stages of another recorder"""
+        for key, (count, seconds, max_seconds, rows) in stages.items():
+            self.add(key, seconds, rows, count, max_seconds)
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+
+    def snapshot(self):
+        """Get a list of the stages, slowest in total first"""
+        with self._lock:
+            stages = dict(self.stages)
+        return [{"stage": stage, "strategy": strategy, "ticker": ticker, "count": count, "total_seconds": seconds,
+            "mean_seconds": seconds / count, "max_seconds": max_seconds, "rows": rows}
+            for (stage, strategy, ticker), (count, seconds, max_seconds, rows) in sorted(stages.items(), key=lambda item: -item[1][1])]
+
+    def server_timing(self):
+        """Format the stages as a Server-Timing header, with the time of each stage and strategy summed over tickers"""
+        durations = {}
+        with self._lock:
+            for (stage, strategy, _), (_, seconds, _, _) in self.stages.items():
+                name = stage if strategy is None else f"{stage}.{strategy}"
+                durations[name] = durations.get(name, 0) + seconds
+        return ", ".join(f"{name};dur={seconds * 1e3:.2f}" for name, seconds in durations.items())
+
+
+class Timer:
+    """Context manager timing a stage, set rows to record the number of rows processed"""
+    __slots__ = ("metrics", "key", "rows", "start")
+
+    def __init__(self, metrics, key):
+        self.metrics = metrics
+        self.key = key
+        self.rows = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.record(self.key, time.perf_counter() - self.start, self.rows)
+
+
+class _NullTimer:
+    """Timer used when metrics are disabled, which does nothing"""
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """Per-stage timings and row counts keyed by strategy and ticker.
+
+    Stages are recorded into the recording of the current request (or worker) if there is one, which is added to the
+    totals when it stops, otherwise straight into the totals. Stages can be nested, e.g., indicators are part of a plan.
+    When disabled, timers do nothing.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.totals = Recorder()
+        self._recorder = contextvars.ContextVar("recorder", default=None)
+
+    def timer(self, stage, strategy=None, ticker=None):
+        """Get a context manager timing a stage"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return Timer(self, (stage, strategy, ticker))
+
+    def record(self, key, seconds, rows=None):
+        (self._recorder.get() or self.totals).add(key, seconds, rows)
+
+    def merge(self, stages):
+        """Add stages recorded elsewhere, e.g., in a worker process, to the current recording or the totals"""
+        if stages:
+            (self._recorder.get() or self.totals).merge(stages)
+
+    def start_recording(self):
+        """Start recording stages separately in this context, returning the recording to stop"""
+        recorder = Recorder()
+        previous = self._recorder.get()
+        self._recorder.set(recorder)
+        return recorder, previous
+
+    def stop_recording(self, recording, add_to_totals=True):
+        """Stop a recording, adding its stages to the totals"""
+        recorder, previous = recording
+        self._recorder.set(previous)
+        if add_to_totals:
+            self.totals.merge(recorder.stages)
+        return recorder
+
+    def snapshot(self):
+        return self.totals.snapshot()
+
+    def reset(self):
+        self.totals.reset()
+
+
+metrics = Metrics(enabled=os.environ.get("INVESTMENT_STRATEGY_METRICS", "1") != "0")
+
+
+def run_recorded(func, *args):
+    """Run a function, e.g., on a thread or process pool, returning its result and the stages recorded while it ran"""
+    if not metrics.enabled:
+        return func(*args), None
+    recording = metrics.start_recording()
+    try:
+        result = func(*args)
+    finally:
+        recorder = metrics.stop_recording(recording, add_to_totals=False)
+    return result, recorder.stages
+
+
+def get_recorded_result(recorded):
+    """Add the stages recorded by run_recorded to the current recording and return the result"""
+    result, stages = recorded
+    metrics.merge(stages)
+    return result
+
+
+def iter_timed(iterable, stage, strategy=None, ticker=None):
+    """Iterate over an iterable, e.g., a streamed response, timing the whole iteration as a stage"""
+    with metrics.timer(stage, strategy, ticker):
+        yield from iterable
+
+
+class SamplingProfiler:
+    """A profiler which samples the stacks of all threads every interval seconds on a background thread.
+
+    Stacks are counted in the collapsed format (frames separated by semicolons, rooted at the thread name) read by
+    flamegraph.pl and speedscope. All threads are sampled, so concurrent requests appear in each other's profiles.
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, name="SamplingProfiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, path=None):
+        """Stop sampling and write the stacks to path if given"""
+        self._stop.set()
+        self._thread.join()
+        if path is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.writelines(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+        return self.stacks
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
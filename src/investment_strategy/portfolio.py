@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+from investment_strategy.date_utils import get_schedule, get_schedule_positions, date_frequency_to_schedule_intervals, get_nearest_date_positions
+from investment_strategy.filter import remove_zero_open_data
+from investment_strategy.strategies_utils import get_plan_arrays
+
+
+def align_prices(histories, item="Open"):
+    """Align the price histories of several tickers into one matrix with a row per date and a column per ticker.
+
+    Histories are cleaned with remove_zero_open_data and matched on their local dates, so tickers on exchanges in
+    different timezones line up. Missing prices, e.g., on holidays, are the last price before them, and prices before a
+    ticker's first date are NaN. Returns the dates, in the timezone of the first history, and the matrix.
+    """
+    dates = []
+    values = []
+    tz = None
+    for df in histories.values():
+        df = remove_zero_open_data(df)
+        index = df.index if df.index.tz is None else df.index.tz_localize(None)
+        tz = df.index.tz if tz is None else tz
+        dates.append(index.normalize().asi8)
+        values.append(df[item].to_numpy(dtype=float))
+
+    all_dates = np.unique(np.concatenate(dates)) if dates else np.array([], dtype=np.int64)
+    prices = np.full((len(all_dates), len(dates)), np.nan)
+    for column, (ticker_dates, ticker_values) in enumerate(zip(dates, values)):
+        prices[np.searchsorted(all_dates, ticker_dates), column] = ticker_values
+
+    # Fill missing prices with the last price before them, which is NaN before the first price
+    last_valid = np.where(np.isnan(prices), 0, np.arange(len(all_dates))[:, None])
+    np.maximum.accumulate(last_valid, axis=0, out=last_valid)
+    prices = prices[last_valid, np.arange(len(dates))]
+
+    index = pd.DatetimeIndex(all_dates)
+    return (index.tz_localize(tz) if tz is not None else index), prices
+
+
+class Portfolio:
+    """A basket of tickers with target weights, evaluated with the plan of a strategy split between the tickers.
+
+    Prices are kept in one matrix with a row per date and a column per ticker, from the first date all the tickers have
+    prices, and the ledger is calculated with matrix operations, so hundreds of tickers don't need a df each. Strategies
+    make their plan on the basket, the weighted sum of each ticker's price relative to its first price.
+    """
+    def __init__(self, histories, weights=None, item="Open"):
+        self.tickers = list(histories)
+        if len(self.tickers) == 0:
+            raise ValueError("A portfolio needs at least one ticker")
+        index, prices = align_prices(histories, item)
+
+        complete = np.flatnonzero(~np.isnan(prices).any(axis=1))
+        if len(complete) == 0:
+            raise ValueError("The tickers have no dates in common")
+        self.index = index[complete[0]:]
+        self.prices = prices[complete[0]:]
+
+        weights = np.ones(len(self.tickers)) if weights is None else np.array([weights.get(ticker, 0) for ticker in self.tickers], dtype=float)
+        if (weights < 0).any() or weights.sum() <= 0:
+            raise ValueError("Weights should not be negative and should not all be zero")
+        self.weights = weights / weights.sum()
+        self.ledger = None   # Dict of matrices of the investments, units, value, etc. for each date and ticker from the last evaluation
+
+    def get_basket_df(self):
+        """Get a df of the basket, with the weighted sum of each ticker's price relative to its first price as Open"""
+        basket = (self.prices / self.prices[0]) @ self.weights * 100
+        return pd.DataFrame({"Open": basket}, index=self.index)
+
+    def evaluate(self, strategy_class, investments, strategy_parameters={}, start_date=None, end_date=None, rebalance_frequency=None,
+            indicator_store=None):
+        """Evaluate a strategy on the portfolio, rebalancing to the weights at rebalance_frequency (if given).
+
+        Returns a summary of the total and each ticker, and a df of the basket and the total investments, value and
+        returns. The ledger of each ticker is kept in the ledger and can be got as dfs with get_ticker_results.
+        """
+        basket_df = self.get_basket_df()
+        strategy = strategy_class(basket_df, investments, strategy_parameters=strategy_parameters, start_date=start_date, end_date=end_date,
+            indicator_store=indicator_store)
+        if not strategy.plan:
+            raise ValueError("No strategic plan loaded to evaluate")
+
+        investment = np.zeros(len(self.index))
+        dates, amounts = get_plan_arrays(strategy.plan)
+        np.add.at(investment, get_nearest_date_positions(self.index, dates), amounts)
+
+        rebalance_positions = []
+        if rebalance_frequency is not None:
+            schedule = get_schedule(strategy.start_date, strategy.end_date, date_frequency_to_schedule_intervals(rebalance_frequency), ignore_first_date=True)
+            rebalance_positions = np.unique(get_schedule_positions(self.index, schedule)).tolist()
+
+        self.calculate_ledger(investment, rebalance_positions)
+        end = self.index.searchsorted(strategy.end_date, side="right") - 1
+        return self.summarise(strategy.start_date, strategy.end_date, end), self.get_results(basket_df, strategy.indicators)
+
+    def calculate_ledger(self, investment, rebalance_positions=()):
+        """Calculate the ledger for investments in each row, split by the weights, and rebalance at the positions.
+
+        At each rebalance, after any investment on that date, units are moved between tickers so their values are in
+        proportion to the weights. The value moved into a ticker counts as invested in it, so the total invested in the
+        tickers is the total investment.
+        """
+        invested = investment[:, None] * self.weights
+        units_cum = np.cumsum(invested / self.prices, axis=0)
+
+        # Rebalancing depends on the units after earlier rebalances, so only the rebalances themselves are sequential
+        transfers = np.zeros_like(units_cum)
+        offset = np.zeros(len(self.tickers))
+        for position in rebalance_positions:
+            units = units_cum[position] + offset
+            target = (units @ self.prices[position]) * self.weights / self.prices[position]
+            transfers[position] = target - units
+            offset = target - units_cum[position]
+        units_cum += np.cumsum(transfers, axis=0)
+
+        investment_cum = np.cumsum(invested + transfers * self.prices, axis=0)
+        total_value = units_cum * self.prices
+        self.ledger = {"investment": invested, "investment_cum": investment_cum, "units_cum": units_cum, "total_value": total_value,
+            "returns": total_value - investment_cum}
+
+    def get_results(self, basket_df, indicators=None):
+        """Get a df of the basket and the totals of the ledger over all the tickers"""
+        df = basket_df.copy(deep=False)
+        if indicators is not None:
+            df[indicators.columns] = indicators
+        for column in ("investment", "investment_cum", "total_value", "returns"):
+            df[column] = self.ledger[column].sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            df["percentage_returns"] = np.nan_to_num(((df["total_value"] / df["investment_cum"]) - 1) * 100)
+        return df
+
+    def get_ticker_results(self, column):
+        """Get a column of the ledger, e.g., units_cum, as a df with a row per date and a column per ticker"""
+        return pd.DataFrame(self.ledger[column], index=self.index, columns=self.tickers)
+
+    def summarise(self, start_date, end_date, end):
+        """Summarise the total and each ticker at the end position"""
+        tickers = {}
+        for i, ticker in enumerate(self.tickers):
+            tickers[ticker] = _summarise_row(self.ledger["investment_cum"][end, i], self.ledger["total_value"][end, i])
+            tickers[ticker].update({"weight": self.weights[i], "units": self.ledger["units_cum"][end, i]})
+
+        total = _summarise_row(self.ledger["investment_cum"][end].sum(), self.ledger["total_value"][end].sum())
+        return {"investment_date": [start_date.isoformat(), end_date.isoformat()], "investment_time_days": (end_date - start_date).days, **total,
+            "tickers": tickers}
+
+
+def _summarise_row(total_invested, value):
+    percentage_returns = ((value / total_invested) - 1) * 100 if total_invested != 0 else 0.0
+    return {"total_invested": total_invested, "value": round(value, 2), "returns": round(value - total_invested, 2),
+        "percentage_returns": round(percentage_returns, 2)}
@@ -0,0 +1,141 @@
+import math
+import numpy as np
+import pandas as pd
+from investment_strategy.date_utils import get_nearest_date_positions, format_datetime_index
+from investment_strategy.strategies import Investments
+from investment_strategy.strategies_utils import get_plan_arrays
+
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def get_log_returns(prices):
+    """Get the log returns between consecutive prices"""
+    return np.diff(np.log(np.asarray(prices, dtype=float)))
+
+
+def bootstrap_paths(log_returns, initial_price, n_paths, n_steps, rng, block_size=20):
+    """Simulate price paths by joining blocks of consecutive historical returns, starting at random points in the history.
+
+    Returns an array with a row of n_steps prices for each path, starting at the initial price. Blocks keep the short term
+    dependence between returns, e.g., periods of high volatility, which sampling single returns would lose.
+    """
+    if len(log_returns) < block_size:
+        raise ValueError(f"There are fewer returns ({len(log_returns)}) than the block size ({block_size})")
+    n_blocks = math.ceil((n_steps - 1) / block_size)
+    starts = rng.integers(0, len(log_returns) - block_size + 1, (n_paths, n_blocks))
+    positions = (starts[:, :, None] + np.arange(block_size)).reshape(n_paths, -1)[:, :n_steps - 1]
+    return _returns_to_prices(log_returns[positions], initial_price)
+
+
+def gbm_paths(log_returns, initial_price, n_paths, n_steps, rng):
+    """Simulate price paths with geometric brownian motion, with the mean and volatility of the historical returns"""
+    increments = rng.normal(log_returns.mean(), log_returns.std(), (n_paths, n_steps - 1))
+    return _returns_to_prices(increments, initial_price)
+
+
+def _returns_to_prices(log_returns, initial_price):
+    prices = np.empty((log_returns.shape[0], log_returns.shape[1] + 1))
+    prices[:, 0] = 0
+    np.cumsum(log_returns, axis=1, out=prices[:, 1:])
+    np.exp(prices, out=prices)
+    return prices * initial_price
+
+
+PATH_GENERATORS = {"bootstrap": bootstrap_paths, "gbm": gbm_paths}
+
+
+def get_simulation_index(df, n_steps):
+    """Get the dates of simulated paths, the n_steps business days after the last date in df"""
+    return pd.bdate_range(df.index[-1].normalize() + pd.offsets.BDay(), periods=n_steps, tz=df.index.tz)
+
+
+def simulate_strategy(df, strategy_class, investment_args, strategy_parameters={}, n_paths=1000, years=20, method="bootstrap",
+        block_size=20, seed=None, chunk_size=128, pool=None, n_points=100):
+    """Run a strategy over many simulated future price paths and summarise the distribution of its returns.
+
+    Paths of years of business days are simulated from the returns of the Open prices in df, either with a block
+    bootstrap or geometric brownian motion. Paths are simulated and evaluated in chunks of chunk_size, each as a 2D array
+    with a row per path, on a pool (e.g., a process pool) if one is given. The ledger of a chunk is calculated for all its
+    paths at once, but only plans which don't depend on the prices are made once per chunk. Strategies with
+    plan_uses_prices make their plan for each path in turn, which costs about as much as running the strategy on a
+    history as long as the path, e.g., tens of ms for VelocityMax over 20 years. Each chunk only keeps a few numbers per
+    path, so memory is bounded by the chunk size and number of workers rather than the number of paths. Each chunk has
+    its own random generator spawned from the seed, so results are the same for a seed however they're run.
+    """
+    if method not in PATH_GENERATORS:
+        raise ValueError(f"Unknown method {method}, should be one of {', '.join(PATH_GENERATORS)}")
+    log_returns = get_log_returns(df["Open"])
+    index = get_simulation_index(df, int(round(years * 252)))
+    fan_positions = np.unique(np.linspace(0, len(index) - 1, n_points).astype(int))
+
+    seed_sequence = np.random.SeedSequence(seed)
+    chunk_sizes = [min(chunk_size, n_paths - i) for i in range(0, n_paths, chunk_size)]
+    chunk_args = [(log_returns, float(df["Open"].iloc[-1]), index, strategy_class, investment_args, strategy_parameters, chunk_n_paths, method,
+        block_size, chunk_seed, fan_positions) for chunk_n_paths, chunk_seed in zip(chunk_sizes, seed_sequence.spawn(len(chunk_sizes)))]
+    if pool is None:
+        chunks = [_simulate_chunk(*args) for args in chunk_args]
+    else:
+        chunks = [future.result() for future in [pool.submit(_simulate_chunk, *args) for args in chunk_args]]
+
+    final_returns = np.concatenate([chunk[0] for chunk in chunks])
+    max_drawdowns = np.concatenate([chunk[1] for chunk in chunks])
+    fan = np.concatenate([chunk[2] for chunk in chunks])
+    return {"n_paths": n_paths, "n_steps": len(index), "method": method, "seed": seed_sequence.entropy,
+        "percentage_returns": _summarise_distribution(final_returns) | {"probability_of_loss": float((final_returns < 0).mean())},
+        "max_drawdown": _summarise_distribution(max_drawdowns),
+        "fan": {"Date": list(format_datetime_index(index[fan_positions], format="short")),
+            "percentiles": {str(q): values.tolist() for q, values in zip(PERCENTILES, np.percentile(fan, PERCENTILES, axis=0))}}}
+
+
+def _summarise_distribution(values):
+    return {"mean": float(values.mean()), "std": float(values.std()),
+        "percentiles": {str(q): float(value) for q, value in zip(PERCENTILES, np.percentile(values, PERCENTILES))}}
+
+
+def _simulate_chunk(log_returns, initial_price, index, strategy_class, investment_args, strategy_parameters, n_paths, method, block_size,
+        seed_sequence, fan_positions):
+    """Simulate and evaluate a chunk of paths, returning the final percentage returns and maximum drawdowns (both in %) and
+    the percentage returns at the fan positions of each path.
+
+    Only the ledger is calculated for all the paths at once, strategies with plan_uses_prices make a df and run the
+    strategy for each path.
+    """
+    rng = np.random.default_rng(seed_sequence)
+    if method == "bootstrap":
+        prices = bootstrap_paths(log_returns, initial_price, n_paths, len(index), rng, block_size)
+    else:
+        prices = gbm_paths(log_returns, initial_price, n_paths, len(index), rng)
+
+    # Plans which don't depend on the prices are the same for every path, others are made one path at a time
+    investment = np.empty_like(prices)
+    for i, path in enumerate(prices):
+        if i == 0 or strategy_class.plan_uses_prices:
+            path_df = pd.DataFrame({"Open": path}, index=index)
+            try:
+                strategy = strategy_class(path_df, Investments(*investment_args), strategy_parameters=strategy_parameters)
+                investment[i] = _get_plan_investment(index, strategy.plan)
+            except Exception as e:
+                # Errors of the strategy are errors in the request, whatever their type
+                raise ValueError(f"{strategy_class.__name__} failed on a simulated path: {e}") from e
+        else:
+            investment[i] = investment[0]
+
+    # The ledger of every path at once, as in Strategy.calculate_ledger
+    units_cum = np.cumsum(investment / prices, axis=1)
+    investment_cum = np.cumsum(investment, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        value_ratio = units_cum * prices / investment_cum
+    value_ratio[np.isnan(value_ratio)] = 1
+    percentage_returns = (value_ratio - 1) * 100
+    max_drawdowns = (1 - value_ratio / np.maximum.accumulate(value_ratio, axis=1)).max(axis=1) * 100
+    return percentage_returns[:, -1], max_drawdowns, percentage_returns[:, fan_positions]
+
+
+def _get_plan_investment(index, plan):
+    """Get the amount invested in each row of index by a plan, summing any which fall on the same date"""
+    investment = np.zeros(len(index))
+    if plan:
+        dates, amounts = get_plan_arrays(plan)
+        np.add.at(investment, get_nearest_date_positions(index, dates), amounts)
+    return investment
@@ -1,7 +1,11 @@
 import warnings
 import random
-from investment_strategy.date_utils import get_schedule, date_frequency_to_schedule_intervals, get_nearest_date_in_df, get_datetime_format
-from investment_strategy.strategies_utils import add_velocity_data, add_velocity_data_with_drag
+import numpy as np
+import pandas as pd
+from investment_strategy.date_utils import get_schedule, date_frequency_to_schedule_intervals, get_nearest_date_positions, get_datetime_format
+from investment_strategy.strategies_utils import get_next_velocity_data_with_drag, get_plan_arrays, GrowableArray, FrameParts
+from investment_strategy.indicators import INDICATORS
+from investment_strategy.metrics import metrics
 
 
 class Investments:
@@ -17,21 +21,99 @@ class Investments:
 
 
 class Strategy:
-    def __init__(self, df, investments, strategy_parameters={}, start_date=None, end_date=None, plan=None):
+    plan_uses_prices = True   # Whether the plan depends on the prices in df, or only on its dates
+
+    def __init__(self, df, investments, strategy_parameters={}, start_date=None, end_date=None, plan=None, indicator_store=None):
         self.df = df
         self.investments = investments
         self.strategy_parameters = strategy_parameters
         self.plan = plan
+        self.indicators = None
+        self.indicator_store = indicator_store   # An IndicatorStore of indicators shared between strategies and requests
+        self.ledger = None   # Arrays of the investments, units, value, etc. for each row of df from the last evaluation
+        self._ledger = None   # The ledger as growable arrays, once the strategy has been updated
+        self.schedule = pd.DatetimeIndex([])
+        self.schedule_positions = None
         self.additional_parameters = self._get_additional_parameters()
-
+        self.requested_start_date = start_date
+        self.requested_end_date = end_date
+        self.set_dates(start_date, end_date)
+
+    @property
+    def df(self):
+        """The price df, joining any bars added by updates"""
+        return self._df.frame()
+
+    @df.setter
+    def df(self, df):
+        self._df = FrameParts(df)
+        self._dates = None   # The dates (as int64 nanoseconds) and Open prices of df as growable arrays, once it's been updated
+        self._open_prices = None
+
+    @property
+    def index(self):
+        """The dates of df, without joining any bars added by updates"""
+        if self._dates is None:
+            return self.df.index
+        values = pd.arrays.DatetimeArray(self._dates.values.view("datetime64[ns]"), dtype=self._index_dtype, copy=False)
+        return pd.DatetimeIndex(values, name=self._index_name, copy=False)
+
+    @property
+    def open_prices(self):
+        """The Open prices of df as an array"""
+        if self._open_prices is None:
+            return self.df['Open'].to_numpy(dtype=float)
+        return self._open_prices.values
+
+    @property
+    def indicators(self):
+        """A df of indicators used by the strategy, with the same index as df"""
+        return None if self._indicators is None else self._indicators.frame()
+
+    @indicators.setter
+    def indicators(self, indicators):
+        self._indicators = None if indicators is None else FrameParts(indicators)
+
+    @property
+    def schedule(self):
+        """Dates of the regular investments"""
+        values = pd.arrays.DatetimeArray(self._schedule.values.view("datetime64[ns]"), dtype=self._schedule_dtype, copy=False)
+        return pd.DatetimeIndex(values, copy=False)
+
+    @schedule.setter
+    def schedule(self, schedule):
+        self._schedule = GrowableArray(schedule.asi8, dtype=np.int64)
+        self._schedule_dtype = schedule.dtype
+
+    @property
+    def schedule_positions(self):
+        """Positions in df of the bars the schedule is matched to, see match_schedule"""
+        return None if self._schedule_positions is None else self._schedule_positions.values
+
+    @schedule_positions.setter
+    def schedule_positions(self, positions):
+        self._schedule_positions = None if positions is None else GrowableArray(positions, dtype=np.intp)
+
+    @property
+    def schedule_matches(self):
+        """Dates of the bars the schedule is matched to"""
+        return None if self._schedule_positions is None else self.index[self.schedule_positions]
+
+    def get_positions(self, dates, past_only=False, future_only=False):
+        """Get the positions in df of the nearest dates to each of dates, see get_nearest_date_positions"""
+        return get_nearest_date_positions(self.index, dates, past_only=past_only, future_only=future_only, is_sorted=self._dates is not None)
+
+    def set_dates(self, start_date=None, end_date=None):
+        """Set the start and end dates of the strategy from the dates requested and the dates in df"""
         # Get start and end dates
+        index = self.index
         if start_date is None:
-            start_date = self.df.index[0]
+            start_date = index[0]
         else:
-            start_date = get_nearest_date_in_df(df, start_date, future_only=True)
+            start_date = index[self.get_positions([start_date], future_only=True)[0]]
 
         if end_date is None:
-            end_date = self.df.index[-1]
+            end_date = index[-1]
 
         # Set start and end dates
         if start_date <= end_date:
@@ -51,54 +133,200 @@ class Strategy:
         """Return additional paramters for the strategy"""
         return []
 
+    def get_indicators(self, name, **parameters):
+        """Get the indicators called name for df, from the indicator store if there is one so they're only calculated once"""
+        with self.timer("indicators") as timer:
+            timer.rows = len(self.df.index)
+            if self.indicator_store is None:
+                return INDICATORS[name](self.df, **parameters)
+            return self.indicator_store.get(self.df, name, **parameters)
+
+    def timer(self, stage):
+        """Get a context manager timing a stage of the strategy, keyed by the strategy and the ticker of df"""
+        return metrics.timer(stage, strategy=type(self).__name__, ticker=self._df.attrs.get("ticker"))
+
+    def update_strategy(self, n_previous):
+        """Carry on the plan for the bars added after the first n_previous bars of df.
+
+        Only the new bars are processed, using the state kept from when the plan was made. The plan has to stay in date
+        order, with only the entries after the date of the last previous bar added or changed, so only these are matched
+        to the bars again. Strategies which can't be carried on return False, so the plan is made again from scratch.
+        """
+        return False
+
+    def extend_schedule(self):
+        """Extend the schedule of regular investments up to the end date, returning the dates added"""
+        intervals = date_frequency_to_schedule_intervals(self.investments.regular_investment_frequency)
+        new_dates = get_schedule(self.schedule[-1] if len(self._schedule) > 0 else self.start_date, self.end_date, intervals, ignore_first_date=True)
+        if len(self._schedule) == 0:
+            self._schedule_dtype = new_dates.dtype
+        self._schedule.extend(new_dates.asi8)
+        if self._schedule_positions is not None:
+            self._schedule_positions.extend(self.get_positions(new_dates, past_only=True))
+        return new_dates
+
+    def match_schedule(self):
+        """Match the schedule of regular investments to the bars in df before each date"""
+        self.schedule_positions = self.get_positions(self.schedule, past_only=True)
+
     def validate_start_date(self):
-        first_date = self.df.index[0]
+        first_date = self.index[0]
         if first_date > self.start_date:
             self.start_date = first_date
             warnings.warn("Data does not exist before date given, using first date in data")
 
     def validate_end_date(self):
-        last_date = self.df.index[-1]
+        last_date = self.index[-1]
         if last_date < self.end_date:
             self.end_date = last_date
             warnings.warn("Data does not exist after date given, using last date in data")
 
-    def summarise(self, df):
-        """Summarise a strategy"""
+    def summarise(self):
+        """Summarise a strategy at the last bar on or before the end date"""
         investment_dates = [self.start_date.isoformat(), self.end_date.isoformat()]
         investment_time = self.end_date - self.start_date
-        total_invested = df.loc[self.end_date, 'investment_cum']
-        value = round(df.loc[self.end_date, 'total_value'], 2)
-        returns = round(df.loc[self.end_date, 'returns'], 2)
-        percentage_returns = round(df.loc[self.end_date, 'percentage_returns'], 2)
+        # Found by position rather than label, as the lookup table of an index shared between threads isn't thread safe
+        end = self.index.searchsorted(self.end_date, side="right") - 1
+        total_invested = self.ledger['investment_cum'][end]
+        value = round(self.ledger['total_value'][end], 2)
+        returns = round(self.ledger['returns'][end], 2)
+        percentage_returns = round(self.ledger['percentage_returns'][end], 2)
         return {"investment_date": investment_dates, "investment_time_days": investment_time.days, "total_invested": total_invested,
             "value": value, "returns": returns, "percentage_returns": percentage_returns}
 
     def evaluate(self):
         """Evaluate a strategy and return a summary of the strategy and the results"""
         if self.plan:
-            # Add investments to df
-            self.df['investment'] = 0
-            for date, amount in self.plan.items():
-                nearest_date = get_nearest_date_in_df(self.df, date)
-                self.df.loc[nearest_date, 'investment'] = amount
-
-            # Calculate value, returns, etc.
-            self.df['investment_cum'] = self.df['investment'].cumsum()
-            self.df['units'] = self.df['investment'] / self.df['Open']
-            self.df['units_cum'] = self.df['units'].cumsum()
-            self.df['total_value'] = self.df['units_cum'] * self.df['Open']
-            self.df['returns'] = self.df['total_value'] - self.df['investment_cum']
-            self.df['percentage_returns'] = ((self.df['total_value'] / self.df['investment_cum']) - 1) * 100
-            self.df[['percentage_returns']] = self.df[['percentage_returns']].fillna(value=0)
-
-            return self.summarise(self.df), self.df
+            with self.timer("ledger") as timer:
+                self.calculate_ledger()
+                timer.rows = len(self.df.index)
+            with self.timer("results"):
+                return self.summarise(), self.get_results()
         else:
             warnings.warn("No strategic plan loaded to evaluate")
 
+    def update(self, new_df):
+        """Add the bars in new_df (sorted by date) after the end of df and evaluate the strategy again, returning the
+        summary and the results of the rows which have changed.
+
+        Strategies which can carry on from their state only process the new bars, keeping the dates, prices, schedule
+        and ledger as growable arrays and the bars and indicators in parts, so an update takes time in proportion to
+        the new bars rather than all the bars. Their results start from the last previous bar, as new bars can change its
+        investment. Other strategies are run again from scratch and return the results of all the bars. Either way the
+        results are the same as running the strategy on all the bars.
+        """
+        if self.ledger is None:
+            return self.evaluate()
+
+        n_previous = self._df.n_rows
+        new_df = new_df.iloc[new_df.index.searchsorted(self.index[-1], side="right"):]
+        if len(new_df.index) == 0:
+            return self.summarise(), self.get_results(n_previous)
+
+        start_date = self.start_date
+        if self._start_updates():
+            self._append(new_df)
+        else:
+            self.df = pd.concat([self.df, new_df])
+        self.set_dates(self.requested_start_date, self.requested_end_date)
+
+        if self._dates is None or self.start_date != start_date or not self.update_strategy(n_previous):
+            self.indicators = None
+            self.plan = self.strategy()
+            return self.evaluate()
+
+        # New bars can only change the investment on the last previous bar, e.g., with investments due on a weekend
+        with self.timer("ledger") as timer:
+            self.calculate_ledger(n_previous - 1)
+            timer.rows = len(new_df.index) + 1
+        with self.timer("results"):
+            return self.summarise(), self.get_results(n_previous - 1)
+
+    def _start_updates(self):
+        """Keep the dates and prices of df as growable arrays to add new bars to, returning False if df isn't sorted"""
+        if self._dates is None:
+            index = self.df.index
+            if not index.is_monotonic_increasing:
+                return False
+            self._dates = GrowableArray(index.asi8, dtype=np.int64)
+            self._open_prices = GrowableArray(self.df['Open'].to_numpy(dtype=float))
+            self._index_dtype = index.dtype
+            self._index_name = index.name
+        return True
+
+    def _append(self, new_df):
+        """Add the bars in new_df to the end of df"""
+        self._df.append(new_df)
+        self._dates.extend(new_df.index.asi8)
+        self._open_prices.extend(new_df['Open'].to_numpy(dtype=float))
+
+    def _get_plan_tail(self, first_row):
+        """Get the dates and amounts of the plan which can fall on the rows from first_row.
+
+        The plan is in date order, so these are the entries at the end of the plan after the date of the row before.
+        """
+        after = self.index[first_row - 1]
+        dates, amounts = [], []
+        for date, amount in reversed(self.plan.items()):
+            if date <= after:
+                break
+            dates.append(date)
+            amounts.append(amount)
+        return dates[::-1], amounts[::-1]
+
+    def calculate_ledger(self, first_row=0):
+        """Calculate the investments, units, value, etc. for each row from first_row, keeping the ledger before it"""
+        # Add investments to the rows, summing any which fall on the same date
+        dates, amounts = get_plan_arrays(self.plan if first_row == 0 else self._get_plan_tail(first_row))
+        positions = self.get_positions(dates)
+        in_rows = positions >= first_row
+        investment = np.zeros(self._df.n_rows - first_row)
+        np.add.at(investment, positions[in_rows] - first_row, amounts[in_rows])
+
+        # Calculate value, returns, etc., with cumulative sums carrying on from the row before first_row
+        open_prices = self.open_prices[first_row:]
+        carried = min(first_row, 1)
+        investment_cum = np.cumsum(np.concatenate([self.ledger['investment_cum'][first_row - 1: first_row] if carried else [], investment]))[carried:]
+        units = investment / open_prices
+        units_cum = np.cumsum(np.concatenate([self.ledger['units_cum'][first_row - 1: first_row] if carried else [], units]))[carried:]
+        total_value = units_cum * open_prices
+        with np.errstate(invalid='ignore', divide='ignore'):
+            percentage_returns = ((total_value / investment_cum) - 1) * 100
+        percentage_returns[np.isnan(percentage_returns)] = 0
+
+        ledger = {'investment': investment, 'investment_cum': investment_cum, 'units': units, 'units_cum': units_cum,
+            'total_value': total_value, 'returns': total_value - investment_cum, 'percentage_returns': percentage_returns}
+        if first_row == 0:
+            self.ledger = ledger
+            self._ledger = None
+            return
+
+        # Later rows are replaced in the growable arrays, so the rows before first_row aren't copied
+        if self._ledger is None:
+            self._ledger = {column: GrowableArray(values) for column, values in self.ledger.items()}
+        for column, values in ledger.items():
+            self._ledger[column].truncate(first_row)
+            self._ledger[column].extend(values)
+        self.ledger = {column: values.values for column, values in self._ledger.items()}
+
+    def get_results(self, first_row=0):
+        """Get df with the indicators and the ledger from the last evaluation added, for the rows from first_row"""
+        n_rows = self._df.n_rows - first_row
+        # Results share the price data with df, so df itself is never modified
+        df = (self.df if first_row == 0 else self._df.tail(n_rows)).copy(deep=False)
+        if self._indicators is not None:
+            indicators = self.indicators if first_row == 0 else self._indicators.tail(n_rows)
+            df[indicators.columns] = indicators
+        for column, values in self.ledger.items():
+            # Growable arrays are changed by later updates, so the results have a copy
+            df[column] = values[first_row:] if self._ledger is None else values[first_row:].copy()
+        return df
+
 
 class InitialInvestment(Strategy):
     """One single investment at the start date"""
+    plan_uses_prices = False
+
     def __init__(self, *args, **kwargs):
         super(InitialInvestment, self).__init__(*args, **kwargs)
         self.plan = self.strategy()
@@ -106,9 +334,14 @@ class InitialInvestment(Strategy):
     def strategy(self):
         return {self.start_date: self.investments.initial_investment}
 
+    def update_strategy(self, n_previous):
+        return True
+
 
 class RegularInvestment(Strategy):
     """A series of regular investments"""
+    plan_uses_prices = False
+
     def __init__(self, *args, **kwargs):
         super(RegularInvestment, self).__init__(*args, **kwargs)
         self.plan = self.strategy()
@@ -119,12 +352,16 @@ class RegularInvestment(Strategy):
         if self.investments.regular_investment != 0:
             # Create an investment schedule and invest according to it
             intervals = date_frequency_to_schedule_intervals(self.investments.regular_investment_frequency)
-            schd = get_schedule(self.start_date, self.end_date, intervals, ignore_first_date=True)
-            for k in schd:
-                investment[k] = self.investments.regular_investment
+            self.schedule = get_schedule(self.start_date, self.end_date, intervals, ignore_first_date=True)
+            investment.update(dict.fromkeys(self.schedule, self.investments.regular_investment))
 
         return investment
 
+    def update_strategy(self, n_previous):
+        if self.investments.regular_investment != 0:
+            self.plan.update(dict.fromkeys(self.extend_schedule(), self.investments.regular_investment))
+        return True
+
 
 class RandomInvestment(Strategy):
     """A series of regular but random investments"""
@@ -166,19 +403,36 @@ class BearDripFeed(Strategy):
         if self.investments.regular_investment != 0:
             # Create an investment schedule and invest according to it
             intervals = date_frequency_to_schedule_intervals(self.investments.regular_investment_frequency)
-            schd = get_schedule(self.start_date, self.end_date, intervals, ignore_first_date=True)
-            schd_date_matches = [get_nearest_date_in_df(self.df, date, past_only=True) for date in schd]
-
-            for k in range(self.strategy_parameters["number_down_periods"], len(schd_date_matches)):
-                investment_date = schd_date_matches[k]
-                # If previous number_down_periods periods are decreasing compared to current one then invest
-                if all(self.df.loc[start_date].Open >= self.df.loc[end_date].Open for start_date, end_date in zip(schd_date_matches[k-self.strategy_parameters["number_down_periods"]: k], schd_date_matches[k-self.strategy_parameters["number_down_periods"] + 1: k+1])):
-                    # # Do not invest if you are not allowed to go overdrawn and the total investment so far is greater than what is possible.
-                    # if self.investments.allow_overdrawn or sum(investment.values()) < len(schd[:k]) * self.investments.regular_investment:
-                    investment[investment_date] = self.investments.regular_investment
+            self.schedule = get_schedule(self.start_date, self.end_date, intervals, ignore_first_date=True)
+            self.match_schedule()
+            self._invest(investment, self.strategy_parameters["number_down_periods"])
 
         return investment
 
+    def update_strategy(self, n_previous):
+        if self.investments.regular_investment != 0:
+            first_k = max(len(self.schedule_positions), self.strategy_parameters["number_down_periods"])
+            self.extend_schedule()
+            self._invest(self.plan, first_k)
+        return True
+
+    def _invest(self, investment, first_k):
+        """Add investments to the plan for the schedule from first_k onwards"""
+        number_down_periods = self.strategy_parameters["number_down_periods"]
+        if first_k >= len(self.schedule_positions):
+            return
+
+        # Prices on the scheduled dates from number_down_periods before first_k, and whether each is at or below the one before
+        prices = self.open_prices[self.schedule_positions[first_k - number_down_periods:]]
+        n_falls = np.concatenate([[0], np.cumsum(prices[:-1] >= prices[1:])])
+
+        # If previous number_down_periods periods are decreasing compared to current one then invest
+        invest = n_falls[number_down_periods:] - n_falls[:len(n_falls) - number_down_periods] == number_down_periods
+        # # Do not invest if you are not allowed to go overdrawn and the total investment so far is greater than what is possible.
+        # if self.investments.allow_overdrawn or sum(investment.values()) < len(schd[:k]) * self.investments.regular_investment:
+        for investment_date in self.index[self.schedule_positions[first_k + np.flatnonzero(invest)]]:
+            investment[investment_date] = self.investments.regular_investment
+
 
 class FallingMarket(Strategy):
     """Invest when the market has fallen below a certain threshold"""
@@ -195,25 +449,44 @@ class FallingMarket(Strategy):
         
         if self.investments.regular_investment != 0:
             intervals = date_frequency_to_schedule_intervals(self.investments.regular_investment_frequency)
-            schd = get_schedule(self.start_date, self.end_date, intervals, ignore_first_date=True)
+            self.schedule = get_schedule(self.start_date, self.end_date, intervals, ignore_first_date=True)
             
-            schd_date_matches = [get_nearest_date_in_df(self.df, date, past_only=True) for date in schd]
-
-            available_funds = 0
-            available_funds_base_investment_percentage = 0.2
-            available_funds_investment_percentage = available_funds_base_investment_percentage
-
-            for k in range(self.strategy_parameters["search_range"], len(schd_date_matches)):
-                investment_date = schd_date_matches[k]
-                # If investment date drops below threshold from search_range before.
-                if self.df.loc[investment_date].Open < self.strategy_parameters["threshold_percentage"] * self.df.loc[schd_date_matches[k - self.strategy_parameters["search_range"]]].Open:
-                    if available_funds > 0:
-                        investment[investment_date] = available_funds
-                        available_funds = 0
-                else:
-                    available_funds += self.investments.regular_investment
+            self.match_schedule()
+
+            self.available_funds = 0
+            self._invest(investment, self.strategy_parameters["search_range"])
         return investment
 
+    def update_strategy(self, n_previous):
+        if self.investments.regular_investment != 0:
+            first_k = max(len(self.schedule_positions), self.strategy_parameters["search_range"])
+            self.extend_schedule()
+            self._invest(self.plan, first_k)
+        return True
+
+    def _invest(self, investment, first_k):
+        """Add investments to the plan for the schedule from first_k onwards, carrying on from the available funds"""
+        search_range = self.strategy_parameters["search_range"]
+        if first_k >= len(self.schedule_positions):
+            return
+
+        # If investment date drops below threshold from search_range before.
+        prices = self.open_prices[self.schedule_positions[first_k - search_range:]]
+        drops = prices[search_range:] < self.strategy_parameters["threshold_percentage"] * prices[:len(prices) - search_range]
+
+        # Funds build up until there's a drop, so only this is done one date at a time
+        index = self.index
+        schedule_positions = self.schedule_positions
+        available_funds = self.available_funds
+        for k, drop in enumerate(drops.tolist(), first_k):
+            if drop:
+                if available_funds > 0:
+                    investment[index[schedule_positions[k]]] = available_funds
+                    available_funds = 0
+            else:
+                available_funds += self.investments.regular_investment
+        self.available_funds = available_funds
+
 
 class Velocity(Strategy):
     """Invest when the market is approaching maximum velocity (falling fast)"""
@@ -231,12 +504,14 @@ class Velocity(Strategy):
         if self.investments.regular_investment != 0:
             intervals = date_frequency_to_schedule_intervals(self.investments.regular_investment_frequency)
             schd = get_schedule(self.start_date, self.end_date, intervals, ignore_first_date=True)
-            schd_date_matches = [get_nearest_date_in_df(self.df, date, past_only=True) for date in schd]
+            schd_positions = get_nearest_date_positions(self.df.index, schd, past_only=True)
+            schd_date_matches = self.df.index[schd_positions]
 
-            add_velocity_data(self.df, self.strategy_parameters["min_velocity"])
+            self.indicators = self.get_indicators("velocity", min_velocity=self.strategy_parameters["min_velocity"])
+            v = self.indicators['v'].to_numpy()[schd_positions]
 
             for k in range(len(schd_date_matches)):
-                v_factor = self.df.loc[schd_date_matches[k], 'v'] / self.strategy_parameters["velocity_threshold"]
+                v_factor = v[k] / self.strategy_parameters["velocity_threshold"]
                 # Amount to spend on all previous months plus this month subtracting what has been invested so far
                 available_funds = ((len(schd[:k]) + 1) * self.investments.regular_investment) - sum(investment.values())
                 if v_factor > 1:
@@ -249,6 +524,10 @@ class Velocity(Strategy):
 
         return investment
 
+    def update_strategy(self, n_previous):
+        # Velocity is normalised by the mean of all the bars, so new bars change the velocity of every bar
+        return False
+
 
 class VelocityMax(Strategy):
     """Invest when the market is approaching maximum velocity and starts to turn (falling fast) taking drag into account"""
@@ -258,13 +537,16 @@ class VelocityMax(Strategy):
 
     @staticmethod
     def _get_additional_parameters():
-        return [{"name": "velocity_threshold", "label": "V Threshold", "type": "number", "default": 4}, {"name": "power_threshold", "label": "P Threshold", "type": "number", "default": 0.01}]
+        return [{"name": "velocity_threshold", "label": "V Threshold", "type": "number", "default": 4}, {"name": "power_threshold", "label": "P Threshold", "type": "number", "default": 0.01},
+            {"name": "moving_average_period", "label": "Moving Average Period", "type": "integer", "default": 5}, {"name": "normalise_window", "label": "Normalise Window", "type": "integer", "default": 180}]
     
     def strategy(self):
         investment = {self.start_date: self.investments.initial_investment}
         
         if self.investments.regular_investment != 0:
-            add_velocity_data_with_drag(self.df)
+            # Windows for smoothing prices and a, and for normalising v, defaulting to the original values if not given
+            self.indicators = self.get_indicators("velocity_with_drag", moving_average_period=int(self.strategy_parameters.get("moving_average_period", 5)),
+                normalise_window=int(self.strategy_parameters.get("normalise_window", 180)))
             # Velocity tells when the marketing is falling fast.
             # Accceleration tells when the market is bouncing back up.
             # Power tells when the market is falling fast and bouncing back up, i.e., when there's a jolt.
@@ -275,43 +557,89 @@ class VelocityMax(Strategy):
 
             # Create an investment schedule, e.g., fixed amount to invest per month
             intervals = date_frequency_to_schedule_intervals(self.investments.regular_investment_frequency)
-            schd = get_schedule(self.start_date, self.end_date, intervals, ignore_first_date=True)
-            schd_date_matches = [get_nearest_date_in_df(self.df, date, past_only=True) for date in schd]
-
-            date_index = 0
-            available_funds = 0
-
-            available_funds_base_investment_percentage = 0.1
-            available_funds_investment_percentate = available_funds_base_investment_percentage
-            temp_v_threshold = self.strategy_parameters["velocity_threshold"]
-            temp_v_threshold_increment = 4
-            for index, row in self.df.iterrows():
-                # Add to available funds
-                if date_index < len(schd_date_matches):
-                    if index == schd_date_matches[date_index]:
-                        available_funds += self.investments.regular_investment
-                        date_index += 1
-
-                # If investment window open
-                if row['v'] > temp_v_threshold:
-                    if row['p'] > self.strategy_parameters["power_threshold"]:
-                        if available_funds_investment_percentate > 1:
-                            available_funds_investment_percentage = 1
-                        
-                        investment_amount = available_funds_investment_percentage * available_funds
-
-                        if investment_amount > available_funds:
-                            investment_amount = available_funds
-                        
-                        if investment_amount > 0:
-                            investment[index] = investment_amount
-                            available_funds -= investment_amount
-                            available_funds_investment_percentage += available_funds_base_investment_percentage
-
-                            temp_v_threshold += temp_v_threshold_increment
-                else:
-                    available_funds_investment_percentage = available_funds_base_investment_percentage
-                    temp_v_threshold = self.strategy_parameters["velocity_threshold"]
+            self.schedule = get_schedule(self.start_date, self.end_date, intervals, ignore_first_date=True)
+            self.match_schedule()
+
+            self.state = {"date_index": 0, "available_funds": 0, "available_funds_investment_percentage": 0.1, "temp_v_threshold": self.strategy_parameters["velocity_threshold"]}
+            self._invest(investment, 0)
 
         return investment
 
+    def update_strategy(self, n_previous):
+        if self.investments.regular_investment != 0:
+            velocity_state = self._indicators.attrs.get("velocity_state")
+            new_indicators = None if velocity_state is None else get_next_velocity_data_with_drag(velocity_state, self._df.tail(self._df.n_rows - n_previous))
+            if new_indicators is None:
+                return False
+            self._indicators.append(new_indicators)
+            self.extend_schedule()
+
+            # Dates added to the schedule can fall on the last previous bar, so it's run again from the state before it
+            self.state = dict(self.last_bar_state)
+            last_bar_investment = self.state.pop("investment")
+            if last_bar_investment is None:
+                self.plan.pop(self.index[n_previous - 1], None)
+            else:
+                self.plan[self.index[n_previous - 1]] = last_bar_investment
+            self._invest(self.plan, n_previous - 1)
+        return True
+
+    def _invest(self, investment, first_row):
+        """Add investments to the plan for the bars from first_row onwards, carrying on from the state"""
+        # The state machine runs over plain lists, with dates as int64 nanoseconds so they're compared without Timestamps
+        dates = self.index
+        indicators = self.indicators if first_row == 0 else self._indicators.tail(len(dates) - first_row)
+        dates_ns = dates.asi8[first_row:].tolist()
+        v = indicators['v'].to_numpy(dtype=float).tolist()
+        p = indicators['p'].to_numpy(dtype=float).tolist()
+        # Only the next scheduled bar is looked up, so the earlier schedule isn't converted again
+        all_dates_ns = dates.asi8
+        schedule_positions = self.schedule_positions
+        power_threshold = self.strategy_parameters["power_threshold"]
+
+        date_index = self.state["date_index"]
+        next_schedule_ns = int(all_dates_ns[schedule_positions[date_index]]) if date_index < len(schedule_positions) else None
+        available_funds = self.state["available_funds"]
+
+        available_funds_base_investment_percentage = 0.1
+        available_funds_investment_percentate = available_funds_base_investment_percentage
+        available_funds_investment_percentage = self.state["available_funds_investment_percentage"]
+        temp_v_threshold = self.state["temp_v_threshold"]
+        temp_v_threshold_increment = 4
+        last_row = len(dates) - 1
+        for i, date_ns, v_i, p_i in zip(range(first_row, last_row + 1), dates_ns, v, p):
+            # Keep the state before the last bar, to run it again if bars are added
+            if i == last_row:
+                self.last_bar_state = {"date_index": date_index, "available_funds": available_funds, "available_funds_investment_percentage": available_funds_investment_percentage,
+                    "temp_v_threshold": temp_v_threshold, "investment": investment.get(dates[i])}
+
+            # Add to available funds
+            if next_schedule_ns is not None:
+                if date_ns == next_schedule_ns:
+                    available_funds += self.investments.regular_investment
+                    date_index += 1
+                    next_schedule_ns = int(all_dates_ns[schedule_positions[date_index]]) if date_index < len(schedule_positions) else None
+
+            # If investment window open
+            if v_i > temp_v_threshold:
+                if p_i > power_threshold:
+                    if available_funds_investment_percentate > 1:
+                        available_funds_investment_percentage = 1
+                    
+                    investment_amount = available_funds_investment_percentage * available_funds
+
+                    if investment_amount > available_funds:
+                        investment_amount = available_funds
+                    
+                    if investment_amount > 0:
+                        investment[dates[i]] = investment_amount
+                        available_funds -= investment_amount
+                        available_funds_investment_percentage += available_funds_base_investment_percentage
+
+                        temp_v_threshold += temp_v_threshold_increment
+            else:
+                available_funds_investment_percentage = available_funds_base_investment_percentage
+                temp_v_threshold = self.strategy_parameters["velocity_threshold"]
+
+        self.state = {"date_index": date_index, "available_funds": available_funds, "available_funds_investment_percentage": available_funds_investment_percentage,
+            "temp_v_threshold": temp_v_threshold}
@@ -1,90 +1,309 @@
+import math
 import numpy as np
+import pandas as pd
 
 
 def add_velocity_data(df, min_velocity=0, g=10):
     """Add velocity data to the df"""
+    df['v'] = get_velocity_data(df, min_velocity, g)['v']
+
+
+def add_velocity_data_with_drag(df, min_velocity=0, m=1e3, g=10, drag_coeff=1e-9, max_possible_gradient=0.9, moving_average_period=5, normalise_window=180):
+    """Add velocity data to the df with drag adding resistance at high velocities"""
+    velocity_df = get_velocity_data_with_drag(df, min_velocity, m, g, drag_coeff, max_possible_gradient, moving_average_period, normalise_window)
+    df[['v', 'a', 'p']] = velocity_df
+
+
+def get_plan_arrays(plan):
+    """Get a plan as parallel arrays of dates and amounts, from either a dict of dates to amounts or a (dates, amounts) pair"""
+    if isinstance(plan, dict):
+        return list(plan.keys()), np.fromiter(plan.values(), dtype=float, count=len(plan))
+    dates, amounts = plan
+    return dates, np.asarray(amounts, dtype=float)
+
+
+class GrowableArray:
+    """A 1D array which values are appended to in amortised constant time per value, by doubling its capacity when full"""
+    def __init__(self, values=(), dtype=float):
+        values = np.asarray(values, dtype=dtype)
+        self._data = np.empty(max(2 * len(values), 16), dtype=dtype)
+        self._data[:len(values)] = values
+        self._n = len(values)
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def values(self):
+        """A view of the values, which is changed by truncating and extending the array"""
+        return self._data[:self._n]
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self._data.dtype)
+        if self._n + len(values) > len(self._data):
+            data = np.empty(max(2 * len(self._data), self._n + len(values)), dtype=self._data.dtype)
+            data[:self._n] = self._data[:self._n]
+            self._data = data
+        self._data[self._n:self._n + len(values)] = values
+        self._n += len(values)
+
+    def truncate(self, n):
+        """Remove the values after the first n"""
+        self._n = min(n, self._n)
+
+
+class FrameParts:
+    """A df which rows are appended to in parts, only joining them when the whole df is needed.
+
+    The joined df has the attrs of all the parts, with later parts taking precedence.
+    """
+    def __init__(self, df):
+        self.parts = [df]
+        self.n_rows = len(df.index)
+
+    @property
+    def attrs(self):
+        attrs = {}
+        for part in self.parts:
+            attrs.update(part.attrs)
+        return attrs
+
+    def append(self, df):
+        self.parts.append(df)
+        self.n_rows += len(df.index)
+
+    def frame(self):
+        if len(self.parts) > 1:
+            attrs = self.attrs
+            df = pd.concat(self.parts)
+            df.attrs = attrs
+            self.parts = [df]
+        return self.parts[0]
+
+    def tail(self, n):
+        """Get the last n rows, only joining the parts they're in"""
+        parts = []
+        for part in reversed(self.parts):
+            if n <= 0:
+                break
+            parts.append(part.iloc[max(len(part.index) - n, 0):])
+            n -= len(part.index)
+        if len(parts) == 1:
+            return parts[0]
+        return pd.concat(parts[::-1]) if parts else self.parts[0].iloc[:0]
+
+
+def get_velocity_data(df, min_velocity=0, g=10):
+    """Get velocity data for the df, returned as a new df with the same index"""
+    velocity_df = pd.DataFrame({'Open': df['Open']}, index=df.index)
 
     # Calculate the difference between dates and Open prices, these are the x and y's. 
-    df['Date'] = df.index
-    df['x_diff'] = df.Date - df.Date.shift(1)
-    df['x_diff'] = df['x_diff'].apply(lambda x: x.total_seconds())     # Convert to number
-    df['y_diff'] = df.Open - df.Open.shift(1)
+    velocity_df['x_diff'] = _seconds_since_previous(velocity_df.index)
+    velocity_df['y_diff'] = velocity_df.Open - velocity_df.Open.shift(1)
 
     # Normalise the x_diff so it's in proportion with the y_diff
-    normalise_factor = df['y_diff'].mean() / df['x_diff'].mean()
-    df['x_diff'] = df['x_diff'] * normalise_factor
+    normalise_factor = velocity_df['y_diff'].mean() / velocity_df['x_diff'].mean()
+    velocity_df['x_diff'] = velocity_df['x_diff'] * normalise_factor
 
     # Calculate theta, s and a for the equations
-    df['theta'] = np.arctan(df['y_diff']/df['x_diff'])
-    df['s'] = np.sqrt(df['x_diff'] ** 2 + df['y_diff'] ** 2)
-    df['a'] = - g * np.sin(df['theta'])     # F = mgsin(theta) - where mg is weight - downwards so negative.
+    velocity_df['theta'] = np.arctan(velocity_df['y_diff']/velocity_df['x_diff'])
+    velocity_df['s'] = np.sqrt(velocity_df['x_diff'] ** 2 + velocity_df['y_diff'] ** 2)
+    velocity_df['a'] = - g * np.sin(velocity_df['theta'])     # F = mgsin(theta) - where mg is weight - downwards so negative.
     
-    # Calculate v by looping through the df
-    # df.loc[df.index[0], 'a2'] = 0
-    df.loc[df.index[0], 'v'] = min_velocity
-    for i in range(1, len(df.index)):
-        v2 = (df.iloc[i - 1].v ** 2) + 2 * df.iloc[i].a * df.iloc[i].s
-        
-        if v2 < 0:
-            v2 = min_velocity
-        
-        df.loc[df.index[i], 'v'] = np.sqrt(v2)
-        # df.loc[df.index[i], 'a2'] = (np.sqrt(v2) - df.iloc[i - 1].v) / df.iloc[i].x_diff
+    # Calculate v by running the recurrence kernel over the a and s arrays
+    velocity_df['v'] = _velocity_kernel(velocity_df['a'].to_numpy(dtype=float), velocity_df['s'].to_numpy(dtype=float), min_velocity)
 
-    df.drop(['x_diff', 'y_diff', 'theta', 's', 'a'], axis=1, inplace=True)
+    return velocity_df[['v']]
 
 
-def add_velocity_data_with_drag(df, min_velocity=0, m=1e3, g=10, drag_coeff=1e-9, max_possible_gradient=0.9, moving_average_period=5, normalise_window=180):
-    """Add velocity data to the df with drag adding resistance at high velocities"""
+def get_velocity_data_with_drag(df, min_velocity=0, m=1e3, g=10, drag_coeff=1e-9, max_possible_gradient=0.9, moving_average_period=5, normalise_window=180):
+    """Get velocity data for the df with drag adding resistance at high velocities, returned as a new df with the same index.
+
+    The state needed to carry on the calculation for bars appended to the df is kept in the attrs of the returned df, see
+    update_velocity_data_with_drag.
+    """
+    state = {"parameters": {"min_velocity": min_velocity, "m": m, "g": g, "drag_coeff": drag_coeff, "max_possible_gradient": max_possible_gradient,
+        "moving_average_period": moving_average_period, "normalise_window": normalise_window}, "last_date": None, "last_moving_average": np.nan,
+        "max_gradient_difference": np.nan, "last_v": None, "moving_average": None, "normalise": None, "a": None}
+    return _velocity_data_with_drag(df, state)
+
+
+def update_velocity_data_with_drag(velocity_df, df):
+    """Extend velocity data from get_velocity_data_with_drag with the bars in the df after the last bar in velocity_df.
+
+    Only the new bars are calculated, carrying on from the state kept in the attrs of velocity_df, and the result is the
+    same as calculating the velocity data for all the bars. Returns None if the new bars change the normalisation of
+    the whole series or the state isn't known, in which case the velocity data has to be calculated again from scratch.
+    """
+    if "velocity_state" not in velocity_df.attrs:
+        return None
+    df = df[df.index > velocity_df.index[-1]] if len(velocity_df.index) > 0 else df
+    if len(df.index) == 0:
+        return velocity_df
+
+    new_velocity_df = get_next_velocity_data_with_drag(velocity_df.attrs["velocity_state"], df)
+    if new_velocity_df is None:
+        return None
+
+    updated_velocity_df = pd.concat([velocity_df, new_velocity_df])
+    updated_velocity_df.attrs = new_velocity_df.attrs
+    return updated_velocity_df
+
+
+def get_next_velocity_data_with_drag(velocity_state, df):
+    """Get velocity data with drag for the bars in df, which follow the bars the velocity state (in the attrs of velocity
+    data) is for, only calculating the new bars. Returns None if the new bars change the normalisation of the whole
+    series, see update_velocity_data_with_drag."""
+    return _velocity_data_with_drag(df, velocity_state)
+
+
+def _velocity_data_with_drag(df, state):
+    """Calculate velocity data with drag for the df carrying on from state, or None if the normalisation has changed"""
+    parameters = state["parameters"]
+    if len(df.index) == 0:
+        velocity_df = pd.DataFrame({'v': [], 'a': [], 'p': []}, index=df.index, dtype=float)
+        velocity_df.attrs["velocity_state"] = state
+        return velocity_df
 
     # Calculate the difference between dates and Open prices, these are the x and y's. 
-    df['Date'] = df.index
-    df['x_diff'] = df.Date - df.Date.shift(1)
-    df['x_diff'] = df['x_diff'].apply(lambda x: x.total_seconds())     # Convert to number
-    df['Open_moving_average'] = df.Open.rolling(moving_average_period).mean()
-    df['y_diff'] = df.Open - df.Open_moving_average.shift(1)
+    open_prices = df['Open'].to_numpy(dtype=float)
+    x_diff = _seconds_since_previous(df.index, state["last_date"])
+    moving_average, moving_average_state = _rolling_mean(open_prices, parameters["moving_average_period"], state=state["moving_average"])
+    y_diff = open_prices - np.concatenate([[state["last_moving_average"]], moving_average[:-1]])
 
-    # Normalise the x_diff so it's in proportion with the y_diff
-    max_gradient_difference = (df['y_diff'] / df['x_diff']).max()
-    normalise_factor = max_gradient_difference / max_possible_gradient
-    df['x_diff'] = df['x_diff'] * normalise_factor
+    # Normalise the x_diff so it's in proportion with the y_diff. This depends on all the bars, so if new bars change it
+    # everything has to be calculated again.
+    with np.errstate(invalid='ignore', divide='ignore'):
+        max_gradient_difference = pd.Series(np.concatenate([[state["max_gradient_difference"]], y_diff / x_diff])).max()
+    if state["last_date"] is not None and max_gradient_difference != state["max_gradient_difference"] and not (np.isnan(max_gradient_difference) and np.isnan(state["max_gradient_difference"])):
+        return None
+    normalise_factor = max_gradient_difference / parameters["max_possible_gradient"]
+    x_diff = x_diff * normalise_factor
 
     # Calculate theta
-    df['theta'] = np.arctan(df['y_diff']/df['x_diff'])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        theta = np.arctan(y_diff / x_diff)
+
+    # Calculate v, a by running the drag kernel over the theta and x_diff arrays
+    v, a = _velocity_with_drag_kernel(theta, x_diff, parameters["min_velocity"], parameters["m"], parameters["g"], parameters["drag_coeff"], v_prev=state["last_v"])
+
+    # Normalise velocity by the current price
+    normalise, normalise_state = _rolling_mean(open_prices, parameters["normalise_window"], min_periods=1, state=state["normalise"])
+
+    # Normalise a and calculate p = av
+    smoothed_a, a_state = _rolling_mean(a, parameters["moving_average_period"], min_periods=1, state=state["a"])
+    velocity_df = pd.DataFrame({'v': v / normalise, 'a': smoothed_a}, index=df.index)
+    velocity_df['p'] = velocity_df.v * velocity_df.a
+
+    velocity_df.attrs["velocity_state"] = dict(state, last_date=df.index[-1], last_moving_average=moving_average[-1], max_gradient_difference=max_gradient_difference,
+        last_v=v[-1], moving_average=moving_average_state, normalise=normalise_state, a=a_state)
+    return velocity_df
+
+
+def _seconds_since_previous(index, previous_date=None):
+    """Get the seconds between each date in a DatetimeIndex and the date before it, NaN for the first date without previous_date"""
+    seconds = np.empty(len(index), dtype=float)
+    if len(index) == 0:
+        return seconds
+    nanoseconds = index.asi8
+    seconds[0] = np.nan if previous_date is None else (nanoseconds[0] - previous_date.value) / 1e9
+    seconds[1:] = np.diff(nanoseconds) / 1e9
+    return seconds
+
+
+def _rolling_mean(values, window, min_periods=None, state=None):
+    """Calculate a rolling mean of an array with running sums, returning it with the state to carry on for following values.
+
+    Like pandas rolling(window, min_periods).mean(), NaN values are skipped and the mean is NaN when there are fewer than
+    min_periods values in the window. Calculating the mean of an array in parts, passing on the state, gives exactly the
+    same result as calculating it in one go.
+    """
+    if window < 1:
+        raise ValueError(f"Rolling window must be at least 1, not {window}")
+    min_periods = window if min_periods is None else min_periods
+    if state is None:
+        state = (np.zeros(window), np.zeros(window, dtype=np.int64))
+    previous_sums, previous_counts = state
+
+    # Cumulative sums carry on from the previous values, windows are the differences between them
+    valid = ~np.isnan(values)
+    sums = np.concatenate([previous_sums, np.cumsum(np.concatenate([previous_sums[-1:], np.where(valid, values, 0)]))[1:]])
+    counts = np.concatenate([previous_counts, np.cumsum(np.concatenate([previous_counts[-1:], valid]))[1:]])
+    window_sums = sums[window:] - sums[:-window]
+    window_counts = counts[window:] - counts[:-window]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(window_counts >= max(min_periods, 1), window_sums / window_counts, np.nan)
+
+    return means, (sums[-window:], counts[-window:])
 
-    # Calculate v, a by looping through the df
-    df.loc[df.index[0], 'v'] = min_velocity
-    df.loc[df.index[0], 'a'] = min_velocity
-    for i in range(1, len(df.index)):
+
+def _velocity_kernel(a, s, min_velocity=0):
+    """Calculate a v array from a and s arrays using v^2 = u^2 + 2as"""
+    n = len(a)
+    v = np.empty(n, dtype=float)
+    if n == 0:
+        return v
+    v[0] = min_velocity
+
+    # The 2as term doesn't depend on the previous velocity so is calculated for all rows at once
+    two_a_s = (2 * a * s).tolist()
+    v_prev = float(min_velocity)
+    for i in range(1, n):
+        v2 = v_prev ** 2 + two_a_s[i]
+
+        if v2 < 0:
+            v2 = min_velocity
+
+        v_prev = math.sqrt(v2) if v2 >= 0 else math.nan
+        v[i] = v_prev
+
+    return v
+
+
+def _velocity_with_drag_kernel(theta, x_diff, min_velocity=0, m=1e3, g=10, drag_coeff=1e-9, v_prev=None):
+    """Calculate v and a arrays from theta and x_diff arrays, with drag adding resistance at high velocities.
+
+    If v_prev is given the arrays carry on from a previous row with velocity v_prev, otherwise they start from the first row.
+    """
+    n = len(theta)
+    v = np.empty(n, dtype=float)
+    a = np.empty(n, dtype=float)
+    if n == 0:
+        return v, a
+    if v_prev is None:
+        v[0] = min_velocity
+        a[0] = min_velocity
+        first, v_prev = 1, v[0]
+    else:
+        first, v_prev = 0, np.float64(v_prev)
+
+    # Terms which don't depend on the previous velocity are calculated for all rows at once
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sin_theta = np.sin(np.abs(theta))
+        k1 = np.sqrt(m * g * sin_theta / drag_coeff)
+        k2 = np.sqrt((drag_coeff * g * sin_theta) / m)
+        flat = np.abs(theta) < 1e-2
+        uphill = theta > 0
+
+    for i in range(first, n):
         # "Flat" (theta is very small, i.e., close to 0)
-        if abs(df.loc[df.index[i], 'theta']) < 1e-2:
-            v = df.iloc[i - 1].v / (drag_coeff * df.iloc[i - 1].v * df.loc[df.index[i], "x_diff"] + 1)
+        if flat[i]:
+            v_i = v_prev / (drag_coeff * v_prev * x_diff[i] + 1)
         # "Uphill" (theta is positive)
-        elif df.loc[df.index[i], 'theta'] > 0:
-            k1 = np.sqrt(m * g * np.sin(df.loc[df.index[i], 'theta']) / drag_coeff)
-            k2 = np.sqrt((drag_coeff * g * np.sin(df.loc[df.index[i], 'theta']))/ m)
-            c = np.arctan((1 / k1) * df.iloc[i - 1].v)
-            v = k1 * np.tan(c - df.loc[df.index[i], "x_diff"] * k2)
+        elif uphill[i]:
+            c = np.arctan((1 / k1[i]) * v_prev)
+            v_i = k1[i] * np.tan(c - x_diff[i] * k2[i])
         # "Downhill" (theta is negative)
         else:
-            k1 = np.sqrt(m * g * np.sin(abs(df.loc[df.index[i], 'theta'])) / drag_coeff)
-            k2 = np.sqrt((drag_coeff * g * np.sin(abs(df.loc[df.index[i], 'theta']))) / m)
-            c = np.arctanh((1 / k1) * df.iloc[i - 1].v)
-            v = k1 * np.tanh(c + df.loc[df.index[i], "x_diff"] * k2)
+            c = np.arctanh((1 / k1[i]) * v_prev)
+            v_i = k1[i] * np.tanh(c + x_diff[i] * k2[i])
 
         # Reset small or NaN values
-        if np.isnan(v) or v < min_velocity:
-            v = min_velocity
-        
-        df.loc[df.index[i], 'v'] = v
-        df.loc[df.index[i], 'a'] = ((v - df.iloc[i - 1].v) / df.iloc[i].x_diff) / m
-
-    # Normalise velocity by the current price
-    df['v'] = df.v / df.Open.rolling(normalise_window, min_periods=1).apply(lambda x: x.mean())
-
-    # Normalise a and calculate p = av
-    df['a'] = df.a.rolling(moving_average_period, min_periods=1).mean()
-    df['p'] = df.v * df.a
+        if np.isnan(v_i) or v_i < min_velocity:
+            v_i = min_velocity
 
-    df.drop(['Open_moving_average', 'x_diff', 'y_diff', 'theta'], axis=1, inplace=True)
+        v[i] = v_i
+        a[i] = ((v_i - v_prev) / x_diff[i]) / m
+        v_prev = v[i]
 
+    return v, a
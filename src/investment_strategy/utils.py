@@ -1,7 +1,8 @@
 import json
+import struct
 import numpy as np
 import pandas as pd
-from .date_utils import convert_datetime_index_to_str
+from .date_utils import format_datetime_index
 
 
 class NpEncoder(json.JSONEncoder):
@@ -18,6 +19,80 @@ class NpEncoder(json.JSONEncoder):
 
 def to_dict(df, datetime_format="short"):
     """Convert df to a dict"""
-    convert_datetime_index_to_str(df, format=datetime_format)
-    df['Date'] = df.index
+    df = df.copy(deep=False)
+    df['Date'] = format_datetime_index(df.index, format=datetime_format)
     return df.to_dict(orient="list")
+
+
+def iter_json_strategy_results(strategy_run_data, datetime_format="short", chunk_size=10000):
+    """Serialise a dict of strategy results to json in chunks, giving the same json as json.dumps after to_dict"""
+    yield "{"
+    for i, (name, run_data) in enumerate(strategy_run_data.items()):
+        yield (", " if i > 0 else "") + json.dumps(name) + ": "
+        if "data" in run_data:
+            yield '{"summary": ' + json.dumps(run_data["summary"], cls=NpEncoder) + ', "data": '
+            yield from iter_json_df(run_data["data"], datetime_format, chunk_size)
+            yield "}"
+        else:
+            yield json.dumps(run_data, cls=NpEncoder)
+    yield "}"
+
+
+def iter_json_df(df, datetime_format="short", chunk_size=10000):
+    """Serialise a df to json in chunks as a dict of column lists, with the dates as the Date column"""
+    columns = {column: df[column].to_numpy() for column in df.columns if column != 'Date'}
+    columns['Date'] = format_datetime_index(df.index, format=datetime_format)
+
+    yield "{"
+    for i, (column, values) in enumerate(columns.items()):
+        yield (", " if i > 0 else "") + json.dumps(column) + ": ["
+        for start in range(0, len(values), chunk_size):
+            # Convert a chunk at a time to python values, so the whole df is never held as python objects
+            chunk = json.dumps(values[start: start + chunk_size].tolist(), cls=NpEncoder)[1: -1]
+            yield (", " if start > 0 else "") + chunk
+        yield "]"
+    yield "}"
+
+
+TYPED_ARRAYS_MIMETYPE = "application/x-typed-arrays"
+
+
+def select_columns(df, columns=None):
+    """Select a subset of the columns in a df, ignoring any which don't exist"""
+    if columns is None:
+        return df
+    return df[[column for column in df.columns if column in columns]]
+
+
+def to_typed_arrays(df, columns=None):
+    """Convert df to a list of (name, array) with little-endian int64 or float64 arrays, with the dates as epoch milliseconds"""
+    arrays = []
+    for column in select_columns(df, columns).columns:
+        if column == 'Date':
+            continue
+        values = df[column].to_numpy()
+        dtype = "<i8" if np.issubdtype(values.dtype, np.integer) or np.issubdtype(values.dtype, np.bool_) else "<f8"
+        arrays.append((column, np.ascontiguousarray(values, dtype=dtype)))
+
+    if columns is None or 'Date' in columns:
+        index = df.index.tz_convert("UTC") if df.index.tz is not None else df.index
+        arrays.append(('Date', (index.asi8 // 10 ** 6).astype("<i8")))
+    return arrays
+
+
+def encode_typed_arrays(header, arrays):
+    """Encode a json header and a list of (group, name, array) in a compact binary format.
+
+    The format is the bytes ISTA, the length of the header as a little-endian uint32, the header as json and then the
+    arrays, each starting on an 8 byte boundary. An "arrays" list is added to the header describing the group, name,
+    dtype, offset (in bytes from the start of the arrays) and length of each array.
+    """
+    descriptions = []
+    offset = 0
+    for group, name, array in arrays:
+        descriptions.append({"group": group, "name": name, "dtype": array.dtype.name, "offset": offset, "length": len(array)})
+        offset += array.nbytes
+
+    header_bytes = json.dumps({**header, "arrays": descriptions}, cls=NpEncoder).encode()
+    header_bytes += b" " * (-(8 + len(header_bytes)) % 8)   # Pad so the arrays are aligned
+    return b"".join([b"ISTA", struct.pack("<I", len(header_bytes)), header_bytes] + [array.tobytes() for _, _, array in arrays])
@@ -0,0 +1,90 @@
+import threading
+import numpy as np
+import pandas as pd
+from investment_strategy.date_utils import get_schedule, date_frequency_to_schedule_intervals, get_nearest_date_positions, format_datetime_index
+from investment_strategy.indicators import INDICATORS
+from investment_strategy.strategies import Investments
+from investment_strategy.strategies_utils import get_plan_arrays
+
+
+class SharedIndicators:
+    """Indicators for a single df shared by every window of a walk forward, so each is only calculated (or hashed) once.
+
+    Used as the indicator store of the strategies, getting indicators from indicator_store the first time if given.
+    """
+    def __init__(self, indicator_store=None):
+        self.indicator_store = indicator_store
+        self.indicators = {}
+        self._lock = threading.Lock()
+
+    def get(self, df, name, **parameters):
+        key = (name, tuple(sorted(parameters.items())))
+        with self._lock:
+            if key not in self.indicators:
+                if self.indicator_store is None:
+                    self.indicators[key] = INDICATORS[name](df, **parameters)
+                else:
+                    self.indicators[key] = self.indicator_store.get(df, name, **parameters)
+            return self.indicators[key]
+
+
+def get_windows(df, horizon_years=10, frequency="months", first_start_date=None):
+    """Get the start and end positions in df of windows of horizon_years, starting on a schedule of the given frequency.
+
+    Starts are the first bar on or after each date on the schedule, and ends the last bar on or before horizon_years
+    after the start. Only windows ending before the last bar in df are included.
+    """
+    first_start_date = df.index[0] if first_start_date is None else pd.Timestamp(first_start_date).tz_convert(df.index.tz)
+    schedule_dates = get_schedule(first_start_date, df.index[-1], date_frequency_to_schedule_intervals(frequency))
+    starts = np.unique(df.index.searchsorted(schedule_dates, side="left"))
+    starts = starts[starts < len(df.index)]
+    end_dates = df.index[starts] + pd.DateOffset(months=int(round(horizon_years * 12)))
+    in_df = end_dates <= df.index[-1]
+    return starts[in_df], df.index.searchsorted(end_dates[in_df], side="right") - 1
+
+
+def get_strategy_start_date(index, start):
+    """Get the start date to give a strategy so it starts at the start position in index.
+
+    Strategies start at the first bar strictly after the start date given, or the first bar if it isn't given.
+    """
+    return None if start == 0 else index[start - 1]
+
+
+def evaluate_windows(df, strategy_class, investment_args, strategy_parameters, starts, ends, indicator_store=None):
+    """Evaluate a strategy for each window between start and end positions in df, returning the summary of each.
+
+    Indicators are calculated once for df and shared by every window. The ledger isn't built for each window, only its
+    last row, using the cumulative investment and units of the plan up to the end of the window.
+    """
+    indicators = SharedIndicators(indicator_store)
+    open_prices = df["Open"].to_numpy(dtype=float)
+    rows = []
+    for start, end in zip(starts, ends):
+        strategy = strategy_class(df, Investments(*investment_args), strategy_parameters=strategy_parameters,
+            start_date=get_strategy_start_date(df.index, start), end_date=df.index[end], indicator_store=indicators)
+        rows.append({"start_date": strategy.start_date, "end_date": strategy.end_date, **summarise_plan(strategy.plan, df.index, open_prices, end)})
+    return rows
+
+
+def summarise_plan(plan, index, open_prices, end):
+    """Get the total invested, value and returns of a plan at the end position, as in the summary of a strategy"""
+    total_invested = total_units = 0.0
+    if plan:
+        dates, amounts = get_plan_arrays(plan)
+        positions = get_nearest_date_positions(index, dates)
+        in_window = positions <= end
+        total_invested = amounts[in_window].sum()
+        total_units = (amounts[in_window] / open_prices[positions[in_window]]).sum()
+    value = total_units * open_prices[end]
+    percentage_returns = ((value / total_invested) - 1) * 100 if total_invested != 0 else 0.0
+    return {"total_invested": total_invested, "value": round(value, 2), "returns": round(value - total_invested, 2),
+        "percentage_returns": round(percentage_returns, 2)}
+
+
+def to_table(rows):
+    """Convert the summaries of windows to a compact table, a dict of column names to lists"""
+    table = pd.DataFrame(rows, columns=["start_date", "end_date", "total_invested", "value", "returns", "percentage_returns"])
+    for column in ("start_date", "end_date"):
+        table[column] = format_datetime_index(pd.DatetimeIndex(table[column]), format="short")
+    return table.to_dict(orient="list")
@@ -0,0 +1,5 @@
+import os
+
+# Keep the api's price and indicator caches in memory rather than in the home directory
+os.environ.setdefault("INVESTMENT_STRATEGY_CACHE_DIR", "")
+os.environ.setdefault("INVESTMENT_STRATEGY_INDICATOR_DIR", "")
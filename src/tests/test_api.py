@@ -0,0 +1,121 @@
+import warnings
+import pytest
+from app import app
+from benchmarks.synthetic import synthetic_downloader
+from investment_strategy import api
+from investment_strategy.cache import PriceHistoryCache
+from investment_strategy.strategies import Strategy, RandomInvestment
+
+
+STRATEGIES = {strategy_class.__name__: {"strategy": strategy_class.__name__, "initial_investment": 1000, "regular_investment": 100,
+    "regular_investment_frequency": "weeks", "start_date": "1900-01-01",
+    **{parameter["name"]: parameter["default"] for parameter in strategy_class._get_additional_parameters()}}
+    for strategy_class in Strategy.__subclasses__() if strategy_class is not RandomInvestment}
+
+
+@pytest.fixture(autouse=True)
+def synthetic_prices(tmp_path, monkeypatch):
+    monkeypatch.setattr(api, "price_cache", PriceHistoryCache(str(tmp_path), downloader=synthetic_downloader(5000)))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        yield
+
+
+def clear_caches():
+    api.data_cache.clear()
+    api.indicator_store.clear()
+
+
+def test_own_index_has_own_lookup_table():
+    df = api.get_data("A")
+    df.index.get_loc(df.index[10])
+    own_df = api._with_own_index(df)
+    assert own_df.index.equals(df.index)
+    assert own_df.index._engine is not df.index._engine
+
+
+def test_run_strategies_in_parallel():
+    # Strategies share the index of the cached df, so each run starts from cold caches to catch races building its lookup table
+    clear_caches()
+    expected = {name: results["summary"] for name, results in api.run_strategies(api.get_data("A"), STRATEGIES, max_workers=1).items()}
+    for _ in range(50):
+        clear_caches()
+        results = api.run_strategies(api.get_data("A"), STRATEGIES, max_workers=len(STRATEGIES))
+        assert {name: result.get("summary", result.get("error")) for name, result in results.items()} == expected
+
+
+def test_sweep_in_parallel():
+    parameter_ranges = {"velocity_threshold": {"start": 1, "stop": 8, "step": 1}}
+    for _ in range(10):
+        clear_caches()
+        results = api.sweep_strategy(api.get_data("A"), "Velocity", 1000, 100, "weeks", parameter_ranges, strategy_parameters=STRATEGIES["Velocity"],
+            max_workers=8)
+        assert all("error" not in result for result in results)
+
+
+@pytest.mark.parametrize("values, parameter_type, expected", [
+    ({"start": 1, "stop": 2, "step": 0.25}, "number", [1.0, 1.25, 1.5, 1.75, 2.0]),
+    ({"start": 1, "stop": 1, "step": 1}, "number", [1.0]),
+    ({"start": 1, "stop": 3, "step": 0.5}, "integer", [1, 2, 3]),
+    ([4, 5], "number", [4.0, 5.0]),
+    (3, None, [3])])
+def test_expand_parameter_range(values, parameter_type, expected):
+    assert api.expand_parameter_range(values, parameter_type) == expected
+
+
+@pytest.mark.parametrize("values", [{"start": 1, "stop": 2, "step": 0}, {"start": 1, "stop": 2, "step": -1}, {"start": 2, "stop": 1, "step": 1},
+    {"start": 1, "stop": 2}, {"start": "1", "stop": 2, "step": 1}, {"start": True, "stop": 2, "step": 1}, []])
+def test_invalid_parameter_range(values):
+    with pytest.raises(ValueError):
+        api.expand_parameter_range(values, "number")
+
+
+def test_sweep_endpoint_rejects_invalid_range():
+    response = app.test_client().post("/api/post_strategy_sweep/", json={"ticker": "A", "strategy": STRATEGIES["Velocity"],
+        "parameter_ranges": {"velocity_threshold": {"start": 1, "stop": 2, "step": 0}}})
+    assert response.status_code == 400
+    assert "positive step" in response.get_json()["error"]
+
+
+def test_job_strategies_run_on_their_own_pool(monkeypatch):
+    pools = []
+    get_executor = api._get_executor
+    monkeypatch.setattr(api, "_get_executor", lambda *args: pools.append(args) or get_executor(*args))
+    monkeypatch.setattr(api, "job_strategy_workers", 1)
+
+    job = api.job_queue.submit(api.run_strategies_job, "A", STRATEGIES)
+    job.future.result()
+    api.run_strategies(api.get_data("A"), {"RegularInvestment": STRATEGIES["RegularInvestment"]})
+
+    assert job.status == "done" and all("summary" in result for result in job.result.values())
+    assert pools == [("thread", 1, "jobs"), ("thread", None, "requests")]
+
+
+def test_simulation_endpoint_uses_the_configured_executor(monkeypatch):
+    pools = []
+    get_executor = api._get_executor
+    monkeypatch.setattr(api, "_get_executor", lambda *args: pools.append(args) or get_executor(*args))
+    monkeypatch.setitem(app.config, "STRATEGY_EXECUTOR", "thread")
+
+    response = app.test_client().post("/api/post_strategy_simulation/", json={"ticker": "A", "strategy": STRATEGIES["RegularInvestment"],
+        "n_paths": 4, "years": 1, "seed": 0})
+    assert response.status_code == 200
+    assert pools == [("thread", None)]
+
+
+def test_simulation_process_pool_isnt_forked():
+    df = api.get_data("A")
+    expected = api.simulate_strategy(df, STRATEGIES["VelocityMax"], n_paths=4, years=1, seed=0, executor="thread")
+    try:
+        assert api.simulate_strategy(df, STRATEGIES["VelocityMax"], n_paths=4, years=1, seed=0, max_workers=1, executor="process") == expected
+        assert api._executors[("process", 1, "requests")]._mp_context.get_start_method() in ("forkserver", "spawn")
+    finally:
+        api._executors.pop(("process", 1, "requests")).shutdown()
+
+
+def test_simulation_endpoint_rejects_failing_strategy():
+    # RandomInvestment raises a TypeError making its plan
+    response = app.test_client().post("/api/post_strategy_simulation/", json={"ticker": "A", "strategy": {**STRATEGIES["RegularInvestment"],
+        "strategy": "RandomInvestment", "randomness": 0.5}, "n_paths": 4, "years": 1, "seed": 0})
+    assert response.status_code == 400
+    assert "RandomInvestment failed" in response.get_json()["error"]
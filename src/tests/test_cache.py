@@ -0,0 +1,66 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from benchmarks.synthetic import synthetic_downloader
+from investment_strategy.cache import PriceHistoryCache, LRUCache
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = PriceHistoryCache(str(tmp_path), downloader=synthetic_downloader(1000))
+    for ticker in ["A", "B", "C"]:
+        cache.get(ticker)
+    entry_bytes = cache.stats()["bytes"] // 3
+
+    cache.get("A")
+    cache.max_bytes = 2 * entry_bytes
+    cache.get("D")
+
+    assert sorted(os.listdir(tmp_path)) == ["A", "D"]
+    assert cache.stats() == {"hits": 1, "misses": 4, "refreshes": 0, "evictions": 2, "entries": 2, "bytes": 2 * entry_bytes}
+
+
+def test_sizes_are_read_at_startup(tmp_path):
+    cache = PriceHistoryCache(str(tmp_path), downloader=synthetic_downloader(1000))
+    for ticker in ["A", "B", "C"]:
+        cache.get(ticker)
+    for last_access, ticker in enumerate(["B", "C", "A"]):
+        os.utime(os.path.join(tmp_path, ticker, "meta.json"), (last_access, last_access))
+
+    restarted_cache = PriceHistoryCache(str(tmp_path), downloader=synthetic_downloader(1000), max_bytes=cache.stats()["bytes"])
+    assert restarted_cache.stats()["entries"] == 3
+    restarted_cache.get("D")
+    assert sorted(os.listdir(tmp_path)) == ["A", "C", "D"]
+
+
+def test_invalidate(tmp_path):
+    cache = PriceHistoryCache(str(tmp_path), downloader=synthetic_downloader(1000))
+    cache.get("A")
+    cache.invalidate("A")
+    assert cache.stats()["entries"] == 0 and cache.stats()["bytes"] == 0
+    assert os.listdir(tmp_path) == []
+
+
+def test_get_or_set_creates_values_once():
+    cache = LRUCache(max_entries=4)
+    calls = []
+    barrier = threading.Barrier(8)
+
+    def get(key):
+        barrier.wait()
+        return cache.get_or_set(key, lambda: calls.append(key) or {"key": key})
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(get, [0, 1] * 4))
+
+    assert results == [{"key": 0}, {"key": 1}] * 4
+    assert sorted(calls) == [0, 1]
+    assert cache._key_locks == {}
+
+
+def test_get_or_set_releases_lock_on_error():
+    cache = LRUCache()
+    with pytest.raises(ValueError):
+        cache.get_or_set("key", lambda: int("x"))
+    assert cache._key_locks == {}
+    assert cache.get_or_set("key", lambda: 1) == 1
@@ -0,0 +1,179 @@
+import random
+import pandas as pd
+import pytest
+from dateutil.relativedelta import relativedelta
+from investment_strategy import date_utils
+from investment_strategy.date_utils import get_schedule, get_nearest_date, get_nearest_date_past, get_nearest_date_future, get_nearest_date_positions
+
+
+TIMEZONES = [None, "UTC", "America/New_York", "Europe/London", "Australia/Sydney"]
+FREQUENCY_INTERVALS = [{"years": 0, "months": 1, "weeks": 0, "days": 0}, {"years": 0, "months": 3, "weeks": 0, "days": 0},
+    {"years": 1, "months": 0, "weeks": 0, "days": 0}, {"years": 0, "months": 0, "weeks": 1, "days": 0},
+    {"years": 0, "months": 0, "weeks": 2, "days": 0}, {"years": 0, "months": 0, "weeks": 0, "days": 1}]
+
+
+def loop_schedule(start, end, intervals, ignore_first_date=False):
+    """The schedule as the original loop made it, adding a relativedelta of the intervals again and again"""
+    step = relativedelta(years=intervals["years"], months=intervals["months"], weeks=intervals["weeks"], days=intervals["days"])
+    schedule = []
+    date = start
+    if ignore_first_date:
+        date += step
+    while date <= end:
+        schedule.append(date)
+        date += step
+    return pd.DatetimeIndex(schedule)
+
+
+def assert_schedule_matches_loop(start, end, intervals, ignore_first_date=False):
+    expected = loop_schedule(start, end, intervals, ignore_first_date)
+    schedule = get_schedule(start, end, intervals, ignore_first_date)
+    assert list(schedule) == list(expected)
+    assert [date.utcoffset() for date in schedule] == [date.utcoffset() for date in expected]
+
+
+@pytest.mark.parametrize("ignore_first_date", [False, True])
+def test_month_end_clamping_sticks(ignore_first_date):
+    start = pd.Timestamp("2021-01-31 09:30", tz="America/New_York")
+    schedule = get_schedule(start, pd.Timestamp("2021-06-30", tz="America/New_York"), FREQUENCY_INTERVALS[0], ignore_first_date)
+    expected = ["2021-01-31", "2021-02-28", "2021-03-28", "2021-04-28", "2021-05-28", "2021-06-28"][1 if ignore_first_date else 0:]
+    assert list(schedule) == [pd.Timestamp(f"{date} 09:30", tz="America/New_York") for date in expected]
+    assert_schedule_matches_loop(start, pd.Timestamp("2024-06-30", tz="America/New_York"), FREQUENCY_INTERVALS[0], ignore_first_date)
+
+
+def test_leap_day_clamping_sticks():
+    assert_schedule_matches_loop(pd.Timestamp("2020-02-29 16:00", tz="Europe/London"), pd.Timestamp("2030-03-01", tz="Europe/London"),
+        FREQUENCY_INTERVALS[2])
+    assert_schedule_matches_loop(pd.Timestamp("2019-12-31"), pd.Timestamp("2021-12-31"), FREQUENCY_INTERVALS[1])
+
+
+@pytest.mark.parametrize("intervals", FREQUENCY_INTERVALS[3:], ids=["weeks", "fortnights", "days"])
+@pytest.mark.parametrize("tz", ["America/New_York", "Europe/London"])
+def test_fixed_schedules_across_dst(intervals, tz):
+    # Days and weeks move on by a fixed amount of time, so the local time changes across DST changes
+    start = pd.Timestamp("2021-03-01 09:30", tz=tz)
+    end = pd.Timestamp("2021-12-01", tz=tz)
+    assert_schedule_matches_loop(start, end, intervals)
+    assert {date.hour for date in get_schedule(start, end, intervals)} == {9, 10}
+
+
+@pytest.mark.parametrize("start", [pd.Timestamp("2021-02-14 02:30"), pd.Timestamp("2020-10-01 01:30")], ids=["nonexistent", "ambiguous"])
+def test_invalid_local_times_use_the_loop(start):
+    # Monthly dates fall on 2021-03-14 02:30, which doesn't exist, or 2020-11-01 01:30, which is ambiguous
+    start = start.tz_localize("America/New_York")
+    assert_schedule_matches_loop(start, start + pd.DateOffset(years=1), FREQUENCY_INTERVALS[0])
+
+
+def test_value_error_falls_back_to_the_loop(monkeypatch):
+    def raise_value_error(*args):
+        raise ValueError("Out of bounds")
+
+    monkeypatch.setattr(date_utils, "_get_calendar_schedule", raise_value_error)
+    monkeypatch.setattr(date_utils, "_get_fixed_schedule", raise_value_error)
+    date_utils._get_schedule.cache_clear()
+    try:
+        for intervals in FREQUENCY_INTERVALS:
+            assert_schedule_matches_loop(pd.Timestamp("2021-01-31 09:30", tz="Europe/London"), pd.Timestamp("2021-12-31", tz="Europe/London"), intervals)
+    finally:
+        date_utils._get_schedule.cache_clear()
+
+
+def test_schedules_dont_move_backwards():
+    with pytest.raises(ValueError):
+        get_schedule(pd.Timestamp("2021-01-01"), pd.Timestamp("2022-01-01"), {"years": 0, "months": 0, "weeks": 0, "days": 0})
+
+
+def test_random_schedules_match_loop():
+    rng = random.Random(0)
+    for _ in range(3000):
+        tz = rng.choice(TIMEZONES)
+        # Starts are biased to the ends of months, where days are clamped
+        month = pd.Timestamp(rng.randint(1990, 2030), rng.randint(1, 12), 1)
+        day = min(rng.choice([1, 15, 28, 29, 30, 31]), month.days_in_month)
+        start = month + pd.Timedelta(days=day - 1, hours=rng.randint(0, 23), minutes=rng.choice([0, 30]))
+        start = start.tz_localize(tz, ambiguous=True, nonexistent="shift_forward") if tz is not None else start
+        intervals = rng.choice(FREQUENCY_INTERVALS)
+        span = pd.Timedelta(days=rng.randint(-10, 100 if intervals["days"] else 400 if intervals["weeks"] else 2000), hours=rng.randint(0, 23))
+        end = start + span
+        if tz is not None and rng.random() < 0.2:
+            end = end.tz_convert(rng.choice(TIMEZONES[1:]))
+        ignore_first_date = rng.random() < 0.5
+
+        try:
+            expected = loop_schedule(start, end, intervals, ignore_first_date)
+        except Exception as e:
+            with pytest.raises(type(e)):
+                get_schedule(start, end, intervals, ignore_first_date)
+            continue
+        schedule = get_schedule(start, end, intervals, ignore_first_date)
+        assert list(schedule) == list(expected), (start, end, intervals, ignore_first_date)
+        assert [date.utcoffset() for date in schedule] == [date.utcoffset() for date in expected], (start, end, intervals, ignore_first_date)
+
+
+NEAREST_DATE_FUNCTIONS = {"nearest": (get_nearest_date, {}), "past_only": (get_nearest_date_past, {"past_only": True}),
+    "future_only": (get_nearest_date_future, {"future_only": True})}
+
+
+@pytest.fixture
+def index():
+    return pd.DatetimeIndex(["2021-01-04 09:30", "2021-01-05 09:30", "2021-01-07 09:30", "2021-01-08 09:30", "2021-01-11 09:30"], tz="America/New_York")
+
+
+def assert_positions_match_nearest_date(index, dates, kind):
+    nearest_date, options = NEAREST_DATE_FUNCTIONS[kind]
+    positions = get_nearest_date_positions(index, dates, **options)
+    assert list(index[positions]) == [nearest_date(list(index), date) for date in dates]
+
+
+@pytest.mark.parametrize("kind", NEAREST_DATE_FUNCTIONS)
+def test_nearest_date_positions_match_nearest_date(index, kind):
+    # Exact matches, dates between bars, ties half way between bars and dates out of range
+    dates = list(index) + [pd.Timestamp(date, tz="America/New_York") for date in ["2021-01-06 09:30", "2021-01-06 21:30", "2021-01-09",
+        "2021-01-10 09:30", "2020-12-31", "2021-02-01"]]
+    assert_positions_match_nearest_date(index, dates, kind)
+
+
+def test_nearest_date_positions_are_strict(index):
+    assert list(get_nearest_date_positions(index, index[1:4], past_only=True)) == [0, 1, 2]
+    assert list(get_nearest_date_positions(index, index[1:4], future_only=True)) == [2, 3, 4]
+    assert list(get_nearest_date_positions(index, index[1:4])) == [1, 2, 3]
+
+
+def test_nearest_date_positions_fall_back_to_the_first_row(index):
+    assert list(get_nearest_date_positions(index, [index[0], index[0] - pd.Timedelta(days=1)], past_only=True)) == [0, 0]
+    assert list(get_nearest_date_positions(index, [index[-1], index[-1] + pd.Timedelta(days=1)], future_only=True)) == [0, 0]
+
+    # The first row rather than the earliest date, when the index isn't sorted
+    unsorted_index = index[[2, 0, 4, 1, 3]]
+    assert list(get_nearest_date_positions(unsorted_index, [index[0]], past_only=True)) == [0]
+    assert list(get_nearest_date_positions(unsorted_index, [index[-1]], future_only=True)) == [0]
+
+
+def test_nearest_date_ties_go_to_the_earlier_date(index):
+    # Half way between 2021-01-05 and 2021-01-07, and between 2021-01-08 and 2021-01-11
+    ties = [pd.Timestamp("2021-01-06 09:30", tz="America/New_York"), pd.Timestamp("2021-01-09 21:30", tz="America/New_York")]
+    assert list(get_nearest_date_positions(index, ties)) == [1, 3]
+
+
+def test_nearest_date_positions_convert_timezones(index):
+    dates = [date.tz_convert("Europe/London") for date in index] + [pd.Timestamp("2021-01-06 14:30", tz="UTC")]
+    assert list(get_nearest_date_positions(index, dates)) == [0, 1, 2, 3, 4, 1]
+    with pytest.raises(TypeError):
+        get_nearest_date_positions(index, [pd.Timestamp("2021-01-06")])
+
+
+@pytest.mark.parametrize("is_sorted", [True, False], ids=["sorted", "unsorted"])
+@pytest.mark.parametrize("kind", NEAREST_DATE_FUNCTIONS)
+def test_random_nearest_date_positions_match_nearest_date(kind, is_sorted):
+    rng = random.Random(0)
+    for _ in range(200):
+        minutes = rng.sample(range(0, 60 * 24 * 30), rng.randint(1, 20))
+        minutes = sorted(minutes) if is_sorted else minutes
+        index = pd.Timestamp("2021-03-01", tz="Europe/London") + pd.to_timedelta(minutes, unit="min")
+        # Random dates are 20 seconds past the minute, so they're never half way between bars
+        dates = list(pd.Timestamp("2021-03-01 00:00:20", tz="Europe/London") + pd.to_timedelta([rng.randint(-600, 60 * 24 * 31) for _ in range(20)], unit="min"))
+        # Dates on and half way between bars as well as random ones, where ties only go to the earlier date in a sorted index
+        dates += rng.sample(list(index), min(len(index), 5))
+        if is_sorted:
+            dates += list(index[:-1] + (index[1:] - index[:-1]) / 2)
+        assert_positions_match_nearest_date(index, dates, kind)
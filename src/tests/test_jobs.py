@@ -0,0 +1,77 @@
+import threading
+from concurrent.futures import wait
+import numpy as np
+import pandas as pd
+from investment_strategy.jobs import JobQueue
+
+
+def test_job_runs():
+    queue = JobQueue(max_workers=1)
+    job = queue.submit(lambda job, x: x * 2, 21)
+    job.future.result()
+    assert (job.status, job.result) == ("done", 42)
+    assert queue.stats()["done"] == 1
+
+
+def test_failed_job():
+    queue = JobQueue(max_workers=1)
+    job = queue.submit(lambda job: int("x"))
+    job.future.result()
+    assert job.status == "failed" and "invalid literal" in job.error
+
+
+def test_same_key_returns_in_flight_job():
+    queue = JobQueue(max_workers=1)
+    release = threading.Event()
+    job = queue.submit(lambda job: release.wait(), key="a")
+    assert queue.submit(lambda job: None, key="a") is job
+    release.set()
+    job.future.result()
+
+
+class CancelledAsChecked(threading.Event):
+    """A cancelled event which cancels its job from another thread the first time a worker checks it"""
+    def __init__(self, queue, job):
+        super().__init__()
+        self.queue = queue
+        self.job = job
+        self.canceller = None
+
+    def is_set(self):
+        if self.canceller is None and threading.current_thread().name.startswith("job"):
+            self.canceller = threading.Thread(target=self.queue.cancel, args=(self.job.id,))
+            self.canceller.start()
+            self.canceller.join(timeout=0.1)
+            return False
+        return super().is_set()
+
+
+def test_job_cancelled_as_it_starts_stays_cancelled():
+    queue = JobQueue(max_workers=1)
+    release = threading.Event()
+    queue.submit(lambda job: release.wait())
+    job = queue.submit(lambda job: job.cancelled.wait(1), key="a")
+    job.cancelled = CancelledAsChecked(queue, job)
+    release.set()
+    wait([job.future])
+    job.cancelled.canceller.join()
+
+    assert job.status == "cancelled" and not job.in_flight()
+    assert queue.submit(lambda job: None, key="a") is not job
+
+
+def test_oldest_results_removed_beyond_max_result_bytes():
+    queue = JobQueue(max_workers=1, max_result_bytes=2500)
+    jobs = [queue.submit(lambda job: {"data": pd.DataFrame({"a": np.zeros(100)})}) for _ in range(4)]
+    wait([job.future for job in jobs])
+    assert jobs[0].nbytes > 800
+
+    # Results of about 928 bytes each, so only the newest two fit
+    assert [queue.get(job.id) is not None for job in jobs] == [False, False, True, True]
+
+
+def test_newest_result_kept_beyond_max_result_bytes():
+    queue = JobQueue(max_workers=1, max_result_bytes=0)
+    job = queue.submit(lambda job: pd.DataFrame({"a": np.zeros(100)}))
+    wait([job.future])
+    assert queue.get(job.id) is job
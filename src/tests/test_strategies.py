@@ -0,0 +1,182 @@
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+from benchmarks.synthetic import synthetic_ohlc
+from investment_strategy.date_utils import get_schedule, get_nearest_date_in_df, date_frequency_to_schedule_intervals
+from investment_strategy.indicators import IndicatorStore
+from investment_strategy.strategies import Strategy, RandomInvestment, RegularInvestment, BearDripFeed, FallingMarket, Velocity, VelocityMax, Investments
+
+
+STRATEGY_CLASSES = [strategy_class for strategy_class in Strategy.__subclasses__() if strategy_class is not RandomInvestment]
+
+
+@pytest.fixture(scope="module")
+def df():
+    return synthetic_ohlc(1500, seed=1)
+
+
+def make_strategy(strategy_class, df, frequency, indicator_store):
+    parameters = {parameter["name"]: parameter["default"] for parameter in strategy_class._get_additional_parameters()}
+    return strategy_class(df, Investments(1000, 100, frequency), strategy_parameters=parameters, indicator_store=indicator_store)
+
+
+@pytest.mark.parametrize("with_store", [False, True], ids=["no_store", "store"])
+@pytest.mark.parametrize("frequency", ["days", "weeks", "months"])
+@pytest.mark.parametrize("strategy_class", STRATEGY_CLASSES, ids=lambda strategy_class: strategy_class.__name__)
+def test_update_matches_full_evaluation(df, strategy_class, frequency, with_store):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        strategy = make_strategy(strategy_class, df.iloc[:1000], frequency, IndicatorStore() if with_store else None)
+        strategy.evaluate()
+
+        # Bars are added in batches of different sizes, including a single bar and none
+        previous = 1000
+        for end in (1001, 1003, 1003, 1250, 1500):
+            summary, results = strategy.update(df.iloc[:end])
+            expected_summary, expected_results = make_strategy(strategy_class, df.iloc[:end], frequency, IndicatorStore() if with_store else None).evaluate()
+
+            assert summary == expected_summary
+            # Strategies carried on only return the rows from the last previous bar, others return all the rows
+            if end == previous:
+                assert len(results.index) == 0
+            elif strategy_class is Velocity:
+                assert len(results.index) == end
+            else:
+                assert len(results.index) == end - previous + 1
+            pd.testing.assert_frame_equal(results, expected_results.iloc[len(expected_results.index) - len(results.index):], check_exact=True)
+            previous = end
+
+        pd.testing.assert_frame_equal(strategy.get_results(), expected_results, check_exact=True)
+        pd.testing.assert_frame_equal(strategy.df, df, check_exact=True)
+
+
+def test_update_doesnt_change_previous_results(df):
+    strategy = make_strategy(RegularInvestment, df.iloc[:1000], "days", None)
+    _, results = strategy.update(df.iloc[:1001])
+    expected_results = results.copy()
+    strategy.update(df.iloc[:1100])
+    pd.testing.assert_frame_equal(results, expected_results, check_exact=True)
+
+
+def original_schedule_matches(strategy):
+    """The schedule matched to the bars as the original strategies did, one date at a time"""
+    intervals = date_frequency_to_schedule_intervals(strategy.investments.regular_investment_frequency)
+    schd = get_schedule(strategy.start_date, strategy.end_date, intervals, ignore_first_date=True)
+    return schd, [get_nearest_date_in_df(strategy.df, date, past_only=True) for date in schd]
+
+
+def original_bear_drip_feed_plan(strategy):
+    """The plan of the original BearDripFeed, comparing the prices of each window of scheduled dates"""
+    df = strategy.df
+    investment = {strategy.start_date: strategy.investments.initial_investment}
+    _, schd_date_matches = original_schedule_matches(strategy)
+    number_down_periods = strategy.strategy_parameters["number_down_periods"]
+    for k in range(number_down_periods, len(schd_date_matches)):
+        investment_date = schd_date_matches[k]
+        if all(df.loc[start_date].Open >= df.loc[end_date].Open for start_date, end_date in zip(schd_date_matches[k - number_down_periods: k], schd_date_matches[k - number_down_periods + 1: k + 1])):
+            investment[investment_date] = strategy.investments.regular_investment
+    return investment
+
+
+def original_falling_market_plan(strategy):
+    """The plan of the original FallingMarket, building up funds until the price drops below the threshold"""
+    df = strategy.df
+    investment = {strategy.start_date: strategy.investments.initial_investment}
+    _, schd_date_matches = original_schedule_matches(strategy)
+    available_funds = 0
+    for k in range(strategy.strategy_parameters["search_range"], len(schd_date_matches)):
+        investment_date = schd_date_matches[k]
+        if df.loc[investment_date].Open < strategy.strategy_parameters["threshold_percentage"] * df.loc[schd_date_matches[k - strategy.strategy_parameters["search_range"]]].Open:
+            if available_funds > 0:
+                investment[investment_date] = available_funds
+                available_funds = 0
+        else:
+            available_funds += strategy.investments.regular_investment
+    return investment
+
+
+def original_velocity_max_plan(strategy, indicators):
+    """The plan of the original VelocityMax state machine, iterating over the rows of the indicators.
+
+    The quirks are kept: the misspelled percentage means it's never capped at 1, and when several scheduled dates match
+    the same bar only the first adds funds, with later dates never matching again.
+    """
+    investment = {strategy.start_date: strategy.investments.initial_investment}
+    _, schd_date_matches = original_schedule_matches(strategy)
+    date_index = 0
+    available_funds = 0
+
+    available_funds_base_investment_percentage = 0.1
+    available_funds_investment_percentate = available_funds_base_investment_percentage
+    temp_v_threshold = strategy.strategy_parameters["velocity_threshold"]
+    temp_v_threshold_increment = 4
+    for index, row in indicators.iterrows():
+        if date_index < len(schd_date_matches):
+            if index == schd_date_matches[date_index]:
+                available_funds += strategy.investments.regular_investment
+                date_index += 1
+
+        if row['v'] > temp_v_threshold:
+            if row['p'] > strategy.strategy_parameters["power_threshold"]:
+                if available_funds_investment_percentate > 1:
+                    available_funds_investment_percentage = 1
+
+                investment_amount = available_funds_investment_percentage * available_funds
+
+                if investment_amount > available_funds:
+                    investment_amount = available_funds
+
+                if investment_amount > 0:
+                    investment[index] = investment_amount
+                    available_funds -= investment_amount
+                    available_funds_investment_percentage += available_funds_base_investment_percentage
+
+                    temp_v_threshold += temp_v_threshold_increment
+        else:
+            available_funds_investment_percentage = available_funds_base_investment_percentage
+            temp_v_threshold = strategy.strategy_parameters["velocity_threshold"]
+    return investment
+
+
+@pytest.mark.parametrize("frequency", ["days", "weeks", "months"])
+@pytest.mark.parametrize("number_down_periods", [1, 3])
+def test_bear_drip_feed_matches_original(df, frequency, number_down_periods):
+    strategy = BearDripFeed(df, Investments(1000, 100, frequency), strategy_parameters={"number_down_periods": number_down_periods})
+    expected = original_bear_drip_feed_plan(strategy)
+    assert len(expected) > 1
+    assert strategy.plan == expected
+
+
+@pytest.mark.parametrize("frequency", ["days", "weeks", "months"])
+@pytest.mark.parametrize("search_range, threshold_percentage", [(1, 0.99), (3, 0.95)])
+def test_falling_market_matches_original(df, frequency, search_range, threshold_percentage):
+    strategy = FallingMarket(df, Investments(1000, 100, frequency), strategy_parameters={"search_range": search_range, "threshold_percentage": threshold_percentage})
+    expected = original_falling_market_plan(strategy)
+    assert len(expected) > 1
+    assert strategy.plan == expected
+
+
+@pytest.mark.parametrize("frequency", ["days", "weeks", "months"])
+@pytest.mark.parametrize("velocity_threshold", [0.5, 4])
+def test_velocity_max_matches_original(df, frequency, velocity_threshold):
+    # Daily schedules match several dates to the bar before each weekend, so funds stop being added after the first
+    strategy = VelocityMax(df, Investments(1000, 100, frequency), strategy_parameters={"velocity_threshold": velocity_threshold, "power_threshold": 0.01})
+    expected = original_velocity_max_plan(strategy, strategy.indicators)
+    assert len(expected) > 1
+    assert strategy.plan == expected
+
+
+def test_velocity_max_matches_original_in_long_windows(df):
+    # A window open for many bars invests more than the available funds without the cap, so the amount is limited to them
+    df = df.iloc[:200]
+    strategy = VelocityMax(df, Investments(1000, 100, "weeks"), strategy_parameters={"velocity_threshold": 4, "power_threshold": 0.01})
+    v = np.where(np.arange(len(df.index)) % 50 >= 20, 1e6, 0.0)
+    strategy.indicators = pd.DataFrame({"v": v, "p": 1.0}, index=df.index)
+    strategy.state = {"date_index": 0, "available_funds": 0, "available_funds_investment_percentage": 0.1, "temp_v_threshold": 4}
+    plan = {strategy.start_date: strategy.investments.initial_investment}
+    strategy._invest(plan, 0)
+
+    expected = original_velocity_max_plan(strategy, strategy.indicators)
+    assert len(expected) > 20
+    assert plan == expected
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+from benchmarks.synthetic import synthetic_ohlc
+from investment_strategy.strategies_utils import get_velocity_data_with_drag, update_velocity_data_with_drag, _velocity_with_drag_kernel
+
+
+PARAMETERS = {"min_velocity": 0, "m": 1e3, "g": 10, "drag_coeff": 1e-9, "max_possible_gradient": 0.9, "moving_average_period": 5,
+    "normalise_window": 180}
+
+
+def original_inputs(df, max_possible_gradient, moving_average_period, **_):
+    """Get theta and x_diff as in the original per-row add_velocity_data_with_drag"""
+    x_diff = pd.Series(df.index, index=df.index).diff().apply(lambda x: x.total_seconds())
+    y_diff = df.Open - df.Open.rolling(moving_average_period).mean().shift(1)
+    x_diff = x_diff * ((y_diff / x_diff).max() / max_possible_gradient)
+    return np.arctan(y_diff / x_diff).to_numpy(), x_diff.to_numpy()
+
+
+def original_loop(theta, x_diff, min_velocity, m, g, drag_coeff, **_):
+    """The per-row loop of the original add_velocity_data_with_drag, over arrays rather than df rows"""
+    v = np.empty(len(theta))
+    a = np.empty(len(theta))
+    v[0] = a[0] = min_velocity
+    for i in range(1, len(theta)):
+        if abs(theta[i]) < 1e-2:
+            v_i = v[i - 1] / (drag_coeff * v[i - 1] * x_diff[i] + 1)
+        elif theta[i] > 0:
+            k1 = np.sqrt(m * g * np.sin(theta[i]) / drag_coeff)
+            k2 = np.sqrt((drag_coeff * g * np.sin(theta[i])) / m)
+            c = np.arctan((1 / k1) * v[i - 1])
+            v_i = k1 * np.tan(c - x_diff[i] * k2)
+        else:
+            k1 = np.sqrt(m * g * np.sin(abs(theta[i])) / drag_coeff)
+            k2 = np.sqrt((drag_coeff * g * np.sin(abs(theta[i]))) / m)
+            c = np.arctanh((1 / k1) * v[i - 1])
+            v_i = k1 * np.tanh(c + x_diff[i] * k2)
+
+        if np.isnan(v_i) or v_i < min_velocity:
+            v_i = min_velocity
+
+        v[i] = v_i
+        a[i] = ((v_i - v[i - 1]) / x_diff[i]) / m
+    return v, a
+
+
+@pytest.fixture(params=[0, 1, 2])
+def df(request):
+    return synthetic_ohlc(2000, seed=request.param)
+
+
+def test_kernel_matches_original_loop(df):
+    theta, x_diff = original_inputs(df, **PARAMETERS)
+    expected_v, expected_a = original_loop(theta, x_diff, **PARAMETERS)
+    v, a = _velocity_with_drag_kernel(theta, x_diff, PARAMETERS["min_velocity"], PARAMETERS["m"], PARAMETERS["g"], PARAMETERS["drag_coeff"])
+
+    np.testing.assert_array_equal(v, expected_v)
+    np.testing.assert_array_equal(a, expected_a)
+    assert (v > 0).any()
+
+
+def test_velocity_data_matches_original(df):
+    theta, x_diff = original_inputs(df, **PARAMETERS)
+    v, a = original_loop(theta, x_diff, **PARAMETERS)
+    expected_v = v / df.Open.rolling(PARAMETERS["normalise_window"], min_periods=1).mean().to_numpy()
+    expected_a = pd.Series(a).rolling(PARAMETERS["moving_average_period"], min_periods=1).mean().to_numpy()
+
+    # Rolling windows are running sums rather than pandas rolling, so only match to rounding
+    velocity_df = get_velocity_data_with_drag(df, **PARAMETERS)
+    assert velocity_df.index.equals(df.index)
+    np.testing.assert_allclose(velocity_df.v, expected_v, rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(velocity_df.a, expected_a, rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(velocity_df.p, expected_v * expected_a, rtol=1e-9, atol=1e-12)
+
+
+@pytest.mark.parametrize("seed, normalisation_changes", [(0, False), (1, True), (2, False)])
+def test_update_matches_full_calculation(seed, normalisation_changes):
+    df = synthetic_ohlc(2000, seed=seed)
+    expected = get_velocity_data_with_drag(df, **PARAMETERS)
+    velocity_df = get_velocity_data_with_drag(df.iloc[:1500], **PARAMETERS)
+    updated = update_velocity_data_with_drag(velocity_df, df)
+
+    # The update is None if the new bars change the normalisation, otherwise it's the same as calculating everything
+    if normalisation_changes:
+        assert updated is None
+    else:
+        pd.testing.assert_frame_equal(updated, expected)
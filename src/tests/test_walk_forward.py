@@ -0,0 +1,46 @@
+import warnings
+import pandas as pd
+import pytest
+from benchmarks.synthetic import synthetic_ohlc
+from investment_strategy import walk_forward
+from investment_strategy.strategies import Investments, RegularInvestment, BearDripFeed, FallingMarket, Velocity, VelocityMax
+
+
+@pytest.fixture(scope="module")
+def df():
+    return synthetic_ohlc(2000, seed=2)
+
+
+def test_windows_start_on_or_after_schedule(df):
+    starts, ends = walk_forward.get_windows(df, horizon_years=2, frequency="months")
+    assert starts[0] == 0
+    # The first of each month is a bar unless it falls on a weekend
+    assert all(df.index[start].day <= 3 for start in starts)
+    assert all(df.index[end] <= df.index[start] + pd.DateOffset(months=24) < df.index[end + 1] for start, end in zip(starts, ends))
+
+    # A schedule date on a bar starts at that bar
+    starts, _ = walk_forward.get_windows(df, horizon_years=2, frequency="months", first_start_date=df.index[10])
+    assert starts[0] == 10
+
+
+@pytest.mark.parametrize("strategy_class", [RegularInvestment, BearDripFeed, FallingMarket, Velocity, VelocityMax],
+    ids=lambda strategy_class: strategy_class.__name__)
+def test_windows_match_strategies(df, strategy_class):
+    parameters = {parameter["name"]: parameter["default"] for parameter in strategy_class._get_additional_parameters()}
+    investment_args = (1000, 100, "weeks")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        starts, ends = walk_forward.get_windows(df, horizon_years=2, frequency="months")
+        rows = walk_forward.evaluate_windows(df, strategy_class, investment_args, parameters, starts, ends)
+
+        assert len(rows) == len(starts) > 0
+        for row, start, end in zip(rows, starts, ends):
+            assert (row["start_date"], row["end_date"]) == (df.index[start], df.index[end])
+            strategy = strategy_class(df, Investments(*investment_args), strategy_parameters=parameters,
+                start_date=walk_forward.get_strategy_start_date(df.index, start), end_date=df.index[end])
+            summary, _ = strategy.evaluate()
+
+            assert summary["investment_date"] == [row["start_date"].isoformat(), row["end_date"].isoformat()]
+            assert row["total_invested"] == pytest.approx(summary["total_invested"], rel=1e-12)
+            for column in ("value", "returns", "percentage_returns"):
+                assert row[column] == pytest.approx(summary[column], abs=0.011)